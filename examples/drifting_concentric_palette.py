@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+pandastim/examples/drifting_concentric_palette.py
+
+Concentric sinusoidal rings drifting outward, animated by rotating a 256-entry
+palette rather than uploading a new image each frame.
+
+Part of pandastim package: https://github.com/EricThomson/pandastim
+"""
+import textures
+import stimuli
+
+ring_index_tex = textures.IndexMapTex(texture_size = 512,
+                                      map_type = 'radius',
+                                      period = 40)
+ring_stim = stimuli.PaletteStim(ring_index_tex,
+                                velocity = 0.5,
+                                profile_on = False,
+                                window_name = 'drifting concentric palette example')
+ring_stim.run()
@@ -0,0 +1,114 @@
+"""
+pandastim/kernels.py
+Float32 kernels for texture waveforms, written in place into uint8 arrays.
+
+Each kernel broadcasts its inputs like a numpy ufunc and works through the
+output in blocks of at most BLOCK_SIZE elements. It uses in-place ufuncs
+(out = ...) on one float32 scratch buffer, so temporary memory stays the same
+however large the texture is, and results go straight into the uint8 output.
+Run this module to benchmark the kernels against the float64 versions that
+utils used before (utils.sin_byte and utils.grating_byte now call these).
+
+Part of pandastim package: https://github.com/EricThomson/pandastim
+"""
+import numpy as np
+
+BLOCK_SIZE = 1 << 16  # elements per block: scratch memory is 4*BLOCK_SIZE bytes
+
+def phase_blocks(x, freq, phase, out):
+    """
+    Iterate over blocks of out, yielding (angle, out_block): angle is a float32
+    scratch array holding freq*x + phase for the block, which kernels may overwrite.
+    """
+    iterator = np.nditer([x, freq, phase, out],
+                         flags = ['external_loop', 'buffered', 'zerosize_ok'],
+                         op_flags = [['readonly'], ['readonly'], ['readonly'], ['writeonly']],
+                         op_dtypes = [np.float32, np.float32, np.float32, np.uint8],
+                         casting = 'unsafe', buffersize = BLOCK_SIZE)
+    scratch = np.empty(BLOCK_SIZE, dtype = np.float32)
+    with iterator:
+        for x_block, freq_block, phase_block, out_block in iterator:
+            angle = scratch[: x_block.shape[0]]
+            np.multiply(x_block, freq_block, out = angle)
+            angle += phase_block
+            yield angle, out_block
+
+def output_array(out, *inputs):
+    if out is None:
+        shape = np.broadcast_shapes(*(np.shape(array) for array in inputs))
+        out = np.empty(shape, dtype = np.uint8)
+    return out
+
+def sin_byte(x, freq = 1, phase = 0, out = None):
+    """
+    uint8 sinusoid (sin(freq*x + phase) + 1)*127.5 (truncated, so 0-255), written
+    into out (made if None). Returns out.
+    """
+    out = output_array(out, x, freq, phase)
+    for angle, out_block in phase_blocks(x, freq, phase, out):
+        np.sin(angle, out = angle)
+        angle += np.float32(1)
+        np.multiply(angle, np.float32(127.5), out = out_block, casting = 'unsafe')
+    return out
+
+def square_byte(x, freq = 1, phase = 0, out = None):
+    """
+    uint8 square wave: 255 for the first half of each cycle of freq*x + phase
+    (cycles are 2*pi long, like scipy.signal.square), 0 for the second half,
+    written into out (made if None). Returns out.
+    """
+    out = output_array(out, x, freq, phase)
+    cycle_scratch = np.empty(BLOCK_SIZE, dtype = np.float32)
+    for angle, out_block in phase_blocks(x, freq, phase, out):
+        angle *= np.float32(1/(2*np.pi))  # in cycles
+        cycle_start = np.floor(angle, out = cycle_scratch[: angle.shape[0]])
+        angle -= cycle_start
+        np.less(angle, np.float32(0.5), out = out_block, casting = 'unsafe')
+        out_block *= np.uint8(255)
+    return out
+
+
+#%% Benchmarks
+if __name__ == '__main__':
+    import time
+    import tracemalloc
+    from scipy import signal
+
+    def sin_byte_float64(X, freq = 1, phase = 0):
+        """utils.sin_byte before it used this module"""
+        sin_float = np.sin(freq*X + phase)
+        sin_transformed = (sin_float + 1)*127.5; #from 0-255
+        return np.uint8(sin_transformed)
+
+    def grating_byte_float64(X, freq = 1, phase = 0):
+        """utils.grating_byte before it used this module"""
+        grating_float = signal.square(X*freq + phase)
+        grating_transformed = (grating_float + 1)*127.5; #from 0-255
+        return np.uint8(grating_transformed)
+
+    def measure(function, repeats = 3):
+        """Best time (s) and peak memory allocated (bytes) over repeats."""
+        best_time = np.inf
+        for repeat in range(repeats):
+            tracemalloc.start()
+            start_time = time.perf_counter()
+            result = function()
+            best_time = min(best_time, time.perf_counter() - start_time)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return best_time, peak_bytes, result
+
+    frequency, phase = 20, 0.3
+    print(f"{'size':>6} {'waveform':>8} {'float64 ms':>11} {'float32 ms':>11} {'speedup':>8} "
+          f"{'float64 MB':>11} {'float32 MB':>11} {'differ':>8}")
+    for texture_size in (1024, 2048, 4096):
+        x = np.linspace(0, 2*np.pi, texture_size + 1)[: texture_size]
+        X = np.broadcast_to(x, (texture_size, texture_size))  # like the meshgrids in textures
+        out = np.empty((texture_size, texture_size), dtype = np.uint8)
+        for name, reference, kernel in (('sin', sin_byte_float64, sin_byte),
+                                        ('square', grating_byte_float64, square_byte)):
+            old_time, old_bytes, old = measure(lambda: reference(X, freq = frequency, phase = phase))
+            new_time, new_bytes, new = measure(lambda: kernel(X, freq = frequency, phase = phase, out = out))
+            differ = np.mean(old != new)  # pixels off by a level, from float32 rounding
+            print(f"{texture_size:>6} {name:>8} {1000*old_time:>11.1f} {1000*new_time:>11.1f} "
+                  f"{old_time/new_time:>7.1f}x {old_bytes/2**20:>11.1f} {new_bytes/2**20:>11.2f} {differ:>8.4%}")
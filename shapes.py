@@ -0,0 +1,226 @@
+"""
+pandastim/shapes.py
+Antialiased shapes (discs, annuli, concentric rings, sectors, polygons) drawn
+into uint8 texture arrays, used by texture classes.
+
+Each function draws one shape into the array out, in place: pixels are blended
+toward intensity by how much of the pixel the shape covers. Coverage comes from
+the signed distance of the pixel center to the edge of the shape (negative inside),
+so edges are smooth without supersampling. Only the pixels inside the shape's
+bounding box are computed, in float32.
+
+Coordinates are in pixels from the center of the array, x increasing with column
+and y with row (row 0 is the bottom of a panda3d texture, so y points up on screen).
+Angles are in degrees, counterclockwise from the x axis.
+
+Part of pandastim package: https://github.com/EricThomson/pandastim
+"""
+import numpy as np
+
+TILE_SIZE = 32  # pixels: tiles entirely inside or outside a shape are filled or skipped
+
+def bounding_box(out, x_min, x_max, y_min, y_max):
+    """
+    Row and column slices of out covering x/y limits (plus a pixel for antialiasing).
+    Returns None if the box lies outside of out.
+    """
+    height, width = out.shape[:2]
+    col_start = max(int(np.floor(x_min + width/2)) - 1, 0)
+    col_stop = min(int(np.ceil(x_max + width/2)) + 1, width)
+    row_start = max(int(np.floor(y_min + height/2)) - 1, 0)
+    row_stop = min(int(np.ceil(y_max + height/2)) + 1, height)
+    if col_start >= col_stop or row_start >= row_stop:
+        return None
+    return slice(row_start, row_stop), slice(col_start, col_stop)
+
+def pixel_coordinates(out, rows, cols):
+    """
+    x (1, width) and y (height, 1) coordinates of the centers of pixels out[rows, cols].
+    """
+    height, width = out.shape[:2]
+    x = np.arange(cols.start, cols.stop, dtype = np.float32) + np.float32(0.5 - width/2)
+    y = np.arange(rows.start, rows.stop, dtype = np.float32) + np.float32(0.5 - height/2)
+    return x[None, :], y[:, None]
+
+def coverage(distance, antialias = True):
+    """
+    Fraction of each pixel covered by a shape, given the signed distance (pixels)
+    of its center to the shape edge: linear over the pixel straddling the edge
+    if antialias, otherwise 1 for centers inside the shape and 0 outside.
+    Overwrites distance.
+    """
+    if not antialias:
+        return np.less_equal(distance, 0, out = distance, casting = 'unsafe')
+    np.subtract(np.float32(0.5), distance, out = distance)
+    return np.clip(distance, 0, 1, out = distance)
+
+def paint(out, rows, cols, shape_coverage, intensity):
+    """
+    Blend out[rows, cols] toward intensity (scalar, or rgb for 3d out) by shape_coverage.
+    """
+    region = out[rows, cols]
+    if region.ndim == 3:
+        shape_coverage = shape_coverage[..., None]
+    blended = region.astype(np.float32)
+    blended += shape_coverage*(np.asarray(intensity, dtype = np.float32) - blended)
+    blended += np.float32(0.5)  # round when truncated to uint8 (values are >= 0)
+    region[...] = blended
+    return out
+
+def draw(out, distance_function, box, intensity = 255, antialias = True):
+    """
+    Draw the shape whose signed distance is distance_function(x, y) into out[box].
+    
+    The box is split into tiles, and the distance is first found at tile centers. 
+    The distance functions are 1-Lipschitz (they change by at most one pixel per 
+    pixel), so tiles whose center is more than half a tile diagonal from the edge 
+    are entirely inside (filled with intensity) or outside (skipped). The distance
+    is only computed for each pixel of the remaining tiles, near the edge.
+    """
+    if box is None:
+        return out
+    rows, cols = box
+    height, width = out.shape[:2]
+    row_starts = np.arange(rows.start, rows.stop, TILE_SIZE)
+    col_starts = np.arange(cols.start, cols.stop, TILE_SIZE)
+    tile_x = (col_starts + (np.minimum(col_starts + TILE_SIZE, cols.stop) - col_starts)/2 - width/2)
+    tile_y = (row_starts + (np.minimum(row_starts + TILE_SIZE, rows.stop) - row_starts)/2 - height/2)
+    tile_distance = distance_function(np.float32(tile_x)[None, :], np.float32(tile_y)[:, None])
+    margin = TILE_SIZE*np.sqrt(2)/2 + 0.5
+    # 0: outside (skip), 1: inside (fill), 2: near edge (compute)
+    tile_state = np.full(tile_distance.shape, 2, dtype = np.int8)
+    tile_state[tile_distance > margin] = 0
+    tile_state[tile_distance < -margin] = 1
+    for row_ind, row_start in enumerate(row_starts):
+        row_slice = slice(row_start, min(row_start + TILE_SIZE, rows.stop))
+        state = tile_state[row_ind]
+        # runs of tiles in the same state are handled together
+        run_starts = np.flatnonzero(np.diff(state)) + 1
+        for start, stop in zip(np.r_[0, run_starts], np.r_[run_starts, len(state)]):
+            if state[start] == 0:
+                continue
+            col_slice = slice(col_starts[start], min(col_starts[stop - 1] + TILE_SIZE, cols.stop))
+            if state[start] == 1:
+                out[row_slice, col_slice] = intensity
+            else:
+                x, y = pixel_coordinates(out, row_slice, col_slice)
+                distance = distance_function(x, y)
+                paint(out, row_slice, col_slice, coverage(distance, antialias), intensity)
+    return out
+
+def radius_from(x, y, center):
+    """
+    Distance of pixel centers from center (float32).
+    """
+    dx = x - np.float32(center[0])
+    dy = y - np.float32(center[1])
+    return np.sqrt(dx*dx + dy*dy)
+
+def disc(out, center, radius, intensity = 255, antialias = True):
+    """
+    Filled circle of radius (pixels) at center.
+    """
+    def distance(x, y):
+        radius_distance = radius_from(x, y, center)
+        radius_distance -= np.float32(radius)
+        return radius_distance
+    box = bounding_box(out, center[0] - radius, center[0] + radius,
+                       center[1] - radius, center[1] + radius)
+    return draw(out, distance, box, intensity, antialias)
+
+def annulus(out, center, inner_radius, outer_radius, intensity = 255, antialias = True):
+    """
+    Ring between inner_radius and outer_radius at center.
+    """
+    def distance(x, y):
+        # distance from the middle of the ring, minus its half width
+        ring_distance = radius_from(x, y, center)
+        ring_distance -= np.float32((inner_radius + outer_radius)/2)
+        np.abs(ring_distance, out = ring_distance)
+        ring_distance -= np.float32((outer_radius - inner_radius)/2)
+        return ring_distance
+    box = bounding_box(out, center[0] - outer_radius, center[0] + outer_radius,
+                       center[1] - outer_radius, center[1] + outer_radius)
+    return draw(out, distance, box, intensity, antialias)
+
+def concentric_rings(out, center, period, width, phase = 0, intensity = 255,
+                     max_radius = None, antialias = True):
+    """
+    Rings width pixels wide, one every period pixels, out to max_radius (default:
+    whole array). The inner edges of the rings are at phase + k*period, so
+    increasing phase moves the rings outward.
+    """
+    if max_radius is None:
+        height, width_out = out.shape[:2]
+        max_radius = np.hypot(width_out/2 + abs(center[0]), height/2 + abs(center[1]))
+    def distance(x, y):
+        radius = radius_from(x, y, center)
+        # distance from the middle of the nearest ring, minus its half width
+        ring_distance = radius - np.float32(phase + width/2 - period/2)
+        # modulo period (np.mod is much slower for floats)
+        wrapped = np.floor(ring_distance*np.float32(1/period))
+        wrapped *= np.float32(period)
+        ring_distance -= wrapped
+        ring_distance -= np.float32(period/2)
+        np.abs(ring_distance, out = ring_distance)
+        ring_distance -= np.float32(width/2)
+        radius -= np.float32(max_radius)
+        return np.maximum(ring_distance, radius, out = ring_distance)  # outside max_radius
+    box = bounding_box(out, center[0] - max_radius, center[0] + max_radius,
+                       center[1] - max_radius, center[1] + max_radius)
+    return draw(out, distance, box, intensity, antialias)
+
+def sector(out, center, radius, start_angle, end_angle, intensity = 255, antialias = True):
+    """
+    Pie slice of the disc of radius at center, counterclockwise from start_angle to end_angle.
+    """
+    span = (end_angle - start_angle) % 360
+    if span == 0 and end_angle != start_angle:
+        return disc(out, center, radius, intensity, antialias)
+    start = np.deg2rad(start_angle)
+    end = np.deg2rad(start_angle + span)
+    def distance(x, y):
+        dx = x - np.float32(center[0])
+        dy = y - np.float32(center[1])
+        # signed distances to the lines through the two edges of the sector (positive outside)
+        start_distance = np.float32(np.sin(start))*dx - np.float32(np.cos(start))*dy
+        end_distance = np.float32(-np.sin(end))*dx + np.float32(np.cos(end))*dy
+        if span <= 180:
+            wedge_distance = np.maximum(start_distance, end_distance)
+        else:
+            wedge_distance = np.minimum(start_distance, end_distance)
+        sector_distance = np.sqrt(dx*dx + dy*dy)
+        sector_distance -= np.float32(radius)
+        return np.maximum(sector_distance, wedge_distance, out = sector_distance)
+    box = bounding_box(out, center[0] - radius, center[0] + radius,
+                       center[1] - radius, center[1] + radius)
+    return draw(out, distance, box, intensity, antialias)
+
+def polygon(out, vertices, intensity = 255, antialias = True):
+    """
+    Filled polygon with vertices [(x0, y0), (x1, y1), ...] (any simple polygon,
+    convex or not; self-intersecting ones are filled with the even-odd rule).
+    """
+    vertices = np.asarray(vertices, dtype = np.float32)
+    edges = [(x0, y0, x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in zip(vertices, np.roll(vertices, -1, axis = 0))
+             if (x1 - x0)**2 + (y1 - y0)**2 > 0]
+    def distance(x, y):
+        shape = np.broadcast_shapes(x.shape, y.shape)
+        distance_squared = np.full(shape, np.inf, dtype = np.float32)
+        inside = np.zeros(shape, dtype = bool)
+        for x0, y0, edge_x, edge_y in edges:
+            # distance to edge segment: project onto the edge, clipped to its ends
+            dx, dy = x - x0, y - y0
+            t = (dx*edge_x + dy*edge_y)/(edge_x**2 + edge_y**2)
+            np.clip(t, 0, 1, out = t)
+            np.minimum(distance_squared, (dx - t*edge_x)**2 + (dy - t*edge_y)**2, out = distance_squared)
+            # even-odd rule: count edges crossed by a ray from the pixel toward +x
+            if edge_y != 0:
+                crosses = (dy >= 0) != (dy >= edge_y)
+                crosses = crosses & (x < x0 + dy*(edge_x/edge_y))
+                inside ^= crosses
+        polygon_distance = np.sqrt(distance_squared, out = distance_squared)
+        return np.negative(polygon_distance, out = polygon_distance, where = inside)
+    box = bounding_box(out, vertices[:, 0].min(), vertices[:, 0].max(),
+                       vertices[:, 1].min(), vertices[:, 1].max())
+    return draw(out, distance, box, intensity, antialias)
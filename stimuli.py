@@ -6,6 +6,7 @@ implements the main event loop in panda3d).
 Part of pandastim package: https://github.com/EricThomson/pandastim
 """
 import sys
+import time
 import numpy as np
 from datetime import datetime
 import logging
@@ -14,7 +15,7 @@ from direct.showbase.ShowBase import ShowBase
 from direct.showbase import ShowBaseGlobal  #global vars defined by p3d
 from panda3d.core import Texture, CardMaker, TextureStage, KeyboardButton
 from panda3d.core import WindowProperties, ColorBlendAttrib, TransformState, ClockObject
-from panda3d.core import AntialiasAttrib
+from panda3d.core import AntialiasAttrib, Shader, SamplerState, NodePath
 from direct.task import Task
 from direct.gui.OnscreenText import OnscreenText   #for binocular stim
 from panda3d.core import PStatClient
@@ -47,6 +48,7 @@ class TexMoving(ShowBase):
     def __init__(self, tex, angle = 0, velocity = 0.1, fps = 30,
                  window_name = "ShowTexMoving", window_size = None, profile_on = False):
         super().__init__()
+        utils.configure_npot(self.win.getGsg())
         self.tex = tex
         if window_size is None:
             self.window_size = self.tex.texture_size
@@ -79,8 +81,9 @@ class TexMoving(ShowBase):
         self.card = self.aspect2d.attachNewNode(cm.generate())
         # Scale is so it can handle arbitrary rotations and shifts in binocular case
         self.card.setScale(np.sqrt(8))
-        self.card.setColor((1, 1, 1, 1)) # makes it bright when bright (default combination with card is add)
+        self.card.setColor(self.tex.tint) # makes it bright when bright (default combination with card is add)
         self.card.setTexture(self.texture_stage, self.tex.texture)
+        self.card.setTexScale(self.texture_stage, self.tex.uv_scale)  # for compact textures
         self.card.setTexRotate(self.texture_stage, self.angle)
         
         if self.velocity != 0:
@@ -89,7 +92,7 @@ class TexMoving(ShowBase):
         
     #Task for moving the texture
     def moveTextureTask(self, task):
-        new_position = -task.time*self.velocity
+        new_position = -task.time*self.velocity*self.tex.uv_scale
         self.card.setTexPos(self.texture_stage, new_position, 0, 0) #u, v, w
         return Task.cont
     
@@ -139,6 +142,7 @@ class InputControlParams(ShowBase):
                  velocities = (0,0), strip_width = 4, fps = 30, window_size = None,
                  window_name = 'position control', profile_on = False, save_path = None):
         super().__init__()
+        utils.configure_npot(self.win.getGsg())
         self.render.setAntialias(AntialiasAttrib.MMultisample)
         self.aspect2d.prepareScene(ShowBaseGlobal.base.win.getGsg())  # pre-loads world
         self.tex = tex
@@ -192,7 +196,7 @@ class InputControlParams(ShowBase):
         self.left_mask = Texture("left_mask_texture")
         self.left_mask.setup2dTexture(self.tex.texture_size, self.tex.texture_size,
                                                Texture.T_unsigned_byte, Texture.F_luminance)
-        self.left_mask.setRamImage(self.left_mask_array)
+        utils.set_ram_image(self.left_mask, self.left_mask_array)
         self.left_mask_stage = TextureStage('left_mask_array')
         #Multiply the texture stages together
         self.left_mask_stage.setCombineRgb(TextureStage.CMModulate,
@@ -207,7 +211,7 @@ class InputControlParams(ShowBase):
         self.right_mask = Texture("right_mask_texture")
         self.right_mask.setup2dTexture(self.tex.texture_size, self.tex.texture_size,
                                                Texture.T_unsigned_byte, Texture.F_luminance)
-        self.right_mask.setRamImage(self.right_mask_array)
+        utils.set_ram_image(self.right_mask, self.right_mask_array)
         self.right_mask_stage = TextureStage('right_mask_stage')
         #Multiply the texture stages together
         self.right_mask_stage.setCombineRgb(TextureStage.CMModulate,
@@ -224,6 +228,8 @@ class InputControlParams(ShowBase):
         self.right_card = self.aspect2d.attachNewNode(cm.generate())
         self.left_card.setAttrib(ColorBlendAttrib.make(ColorBlendAttrib.M_add))
         self.right_card.setAttrib(ColorBlendAttrib.make(ColorBlendAttrib.M_add))
+        self.left_card.setColor(self.tex.tint)
+        self.right_card.setColor(self.tex.tint)
 
         #ADD TEXTURE STAGES TO CARDS
         self.left_card.setTexture(self.left_texture_stage, self.tex.texture)
@@ -241,10 +247,10 @@ class InputControlParams(ShowBase):
         
         # Textures
         # Left
-        self.left_card.setTexScale(self.left_texture_stage, 1/self.scale)
+        self.left_card.setTexScale(self.left_texture_stage, self.tex.uv_scale/self.scale)
         self.left_card.setTexRotate(self.left_texture_stage, self.left_texture_angle)
         # Right 
-        self.right_card.setTexScale(self.right_texture_stage, 1/self.scale)
+        self.right_card.setTexScale(self.right_texture_stage, self.tex.uv_scale/self.scale)
         self.right_card.setTexRotate(self.right_texture_stage, self.right_texture_angle)
         
         #Set task manager(s) for textures
@@ -295,19 +301,19 @@ class InputControlParams(ShowBase):
         
     #Move both textures
     def textures_update(self, task):
-        left_tex_position = -task.time*self.left_velocity #negative b/c texture stage
-        right_tex_position = -task.time*self.right_velocity
+        left_tex_position = -task.time*self.left_velocity*self.tex.uv_scale #negative b/c texture stage
+        right_tex_position = -task.time*self.right_velocity*self.tex.uv_scale
         self.left_card.setTexPos(self.left_texture_stage, left_tex_position, 0, 0)
         self.right_card.setTexPos(self.right_texture_stage, right_tex_position, 0, 0)
         return task.cont
 
     def left_texture_update(self, task):
-        left_tex_position = -task.time*self.left_velocity #negative b/c texture stage
+        left_tex_position = -task.time*self.left_velocity*self.tex.uv_scale #negative b/c texture stage
         self.left_card.setTexPos(self.left_texture_stage, left_tex_position, 0, 0)
         return task.cont
 
     def right_texture_update(self, task):
-        right_tex_position = -task.time*self.right_velocity
+        right_tex_position = -task.time*self.right_velocity*self.tex.uv_scale
         self.right_card.setTexPos(self.right_texture_stage, right_tex_position, 0, 0)
         return task.cont
 
@@ -353,6 +359,7 @@ class BinocularMoving(ShowBase):
                  velocities = (0,0), strip_width = 4, fps = 30, window_size = None,
                  window_name = 'BinocularDrift', profile_on = False):
         super().__init__()
+        utils.configure_npot(self.win.getGsg())
         self.tex = tex
         if window_size == None:
             self.window_size = tex.texture_size
@@ -389,7 +396,7 @@ class BinocularMoving(ShowBase):
         self.left_mask = Texture("left_mask_texture")
         self.left_mask.setup2dTexture(self.tex.texture_size, self.tex.texture_size,
                                                Texture.T_unsigned_byte, Texture.F_luminance)
-        self.left_mask.setRamImage(self.left_mask_array)
+        utils.set_ram_image(self.left_mask, self.left_mask_array)
         self.left_mask_stage = TextureStage('left_mask_array')
         #Multiply the texture stages together
         self.left_mask_stage.setCombineRgb(TextureStage.CMModulate,
@@ -404,7 +411,7 @@ class BinocularMoving(ShowBase):
         self.right_mask = Texture("right_mask_texture")
         self.right_mask.setup2dTexture(self.tex.texture_size, self.tex.texture_size,
                                                Texture.T_unsigned_byte, Texture.F_luminance)
-        self.right_mask.setRamImage(self.right_mask_array)
+        utils.set_ram_image(self.right_mask, self.right_mask_array)
         self.right_mask_stage = TextureStage('right_mask_stage')
         #Multiply the texture stages together
         self.right_mask_stage.setCombineRgb(TextureStage.CMModulate,
@@ -421,6 +428,8 @@ class BinocularMoving(ShowBase):
         self.right_card = self.aspect2d.attachNewNode(cm.generate())
         self.left_card.setAttrib(ColorBlendAttrib.make(ColorBlendAttrib.M_add))
         self.right_card.setAttrib(ColorBlendAttrib.make(ColorBlendAttrib.M_add))
+        self.left_card.setColor(self.tex.tint)
+        self.right_card.setColor(self.tex.tint)
 
         #ADD TEXTURE STAGES TO CARDS
         self.left_card.setTexture(self.left_texture_stage, self.tex.texture)
@@ -435,10 +444,10 @@ class BinocularMoving(ShowBase):
         self.left_card.setTexTransform(self.left_mask_stage, self.mask_transform)
         self.right_card.setTexTransform(self.right_mask_stage, self.mask_transform)
         #Left texture
-        self.left_card.setTexScale(self.left_texture_stage, 1/self.scale)
+        self.left_card.setTexScale(self.left_texture_stage, self.tex.uv_scale/self.scale)
         self.left_card.setTexRotate(self.left_texture_stage, self.left_texture_angle)
         #Right texture
-        self.right_card.setTexScale(self.right_texture_stage, 1/self.scale)
+        self.right_card.setTexScale(self.right_texture_stage, self.tex.uv_scale/self.scale)
         self.right_card.setTexRotate(self.right_texture_stage, self.right_texture_angle)
 
         #Set dynamic transforms
@@ -468,19 +477,19 @@ class BinocularMoving(ShowBase):
 
     #Move both textures
     def textures_update(self, task):
-        left_tex_position = -task.time*self.left_velocity #negative b/c texture stage
-        right_tex_position = -task.time*self.right_velocity
+        left_tex_position = -task.time*self.left_velocity*self.tex.uv_scale #negative b/c texture stage
+        right_tex_position = -task.time*self.right_velocity*self.tex.uv_scale
         self.left_card.setTexPos(self.left_texture_stage, left_tex_position, 0, 0)
         self.right_card.setTexPos(self.right_texture_stage, right_tex_position, 0, 0)
         return task.cont
 
     def left_texture_update(self, task):
-        left_tex_position = -task.time*self.left_velocity #negative b/c texture stage
+        left_tex_position = -task.time*self.left_velocity*self.tex.uv_scale #negative b/c texture stage
         self.left_card.setTexPos(self.left_texture_stage, left_tex_position, 0, 0)
         return task.cont
 
     def right_texture_update(self, task):
-        right_tex_position = -task.time*self.right_velocity
+        right_tex_position = -task.time*self.right_velocity*self.tex.uv_scale
         self.right_card.setTexPos(self.right_texture_stage, right_tex_position, 0, 0)
         return task.cont
 
@@ -515,6 +524,391 @@ class BinocularFixed(BinocularMoving):
         ShowBaseGlobal.base.win.requestProperties(self.window_properties)
 
 
+# Shader for PaletteStim: look up index texture value in the palette. GLSL 1.20 so it
+# also runs with software OpenGL (Mesa).
+palette_vertex_shader = """
+#version 120
+uniform mat4 p3d_ModelViewProjectionMatrix;
+attribute vec4 p3d_Vertex;
+attribute vec2 p3d_MultiTexCoord0;
+varying vec2 texcoord;
+void main() {
+    gl_Position = p3d_ModelViewProjectionMatrix * p3d_Vertex;
+    texcoord = p3d_MultiTexCoord0;
+}
+"""
+palette_fragment_shader = """
+#version 120
+uniform sampler2D index_map;
+uniform sampler2D palette;
+varying vec2 texcoord;
+void main() {
+    float index = texture2D(index_map, texcoord).r*255.0;
+    gl_FragColor = texture2D(palette, vec2((index + 0.5)/256.0, 0.5));
+}
+"""
+
+
+class PaletteStim(ShowBase):
+    """
+    Palette animation: shows a static index texture (e.g., textures.IndexMapTex) 
+    through a 256-entry color table (palette), and animates it by rotating the 
+    palette. Drifting concentric or radial gratings then only upload the 256-entry
+    palette each frame, instead of a full image. The lookup is done in a shader; 
+    if the graphics card can't run shaders, the palette is applied on the CPU 
+    (and full frames are uploaded).
+    
+    Usage:
+        index_tex = textures.IndexMapTex(map_type = 'radius', period = 32)
+        palette_stim = PaletteStim(index_tex, velocity = 0.5)
+        palette_stim.run()
+        
+    Note(s):
+        palette is 256 (gray) or 256 x 3 (rgb) uint8 values holding one cycle of the 
+        pattern: default is one cycle of a sinusoid (utils.sin_byte).
+        velocity is in cycles per second (>0 moves toward increasing index, e.g. outward).
+    """
+    def __init__(self, index_tex, palette = None, velocity = 0.5, fps = 30, window_size = None, 
+                 window_name = "PaletteStim", profile_on = False):
+        super().__init__()
+        utils.configure_npot(self.win.getGsg())
+        self.index_tex = index_tex
+        if palette is None:
+            palette = utils.sin_byte(2*np.pi*np.arange(256)/256)
+        # Palettes are stored as 1 x 256 images in panda3d's (bgr) order, so no conversion on upload
+        self.palette = utils.as_native(np.asarray(palette, dtype = np.uint8)[None])[0]
+        if self.palette.shape[0] != 256:
+            raise ValueError("PaletteStim palette must have 256 entries")
+        self.rotated_palette = utils.as_native(self.palette[None], copy = True)[0]
+        self.palette_shift = 0
+        self.velocity = velocity
+        self.window_size = self.index_tex.texture_size if window_size is None else window_size
+        self.window_name = window_name
+        
+        # Set frame rate
+        ShowBaseGlobal.globalClock.setMode(ClockObject.MLimited)
+        ShowBaseGlobal.globalClock.setFrameRate(fps) 
+        
+        #Set up profiling if desired
+        if profile_on:
+            PStatClient.connect() # this will only work if pstats is running: see readme
+            ShowBaseGlobal.base.setFrameRateMeter(True)  #Show frame rate
+            
+        #Window properties set up 
+        self.window_properties = WindowProperties()
+        self.window_properties.setSize(self.window_size, self.window_size)
+        self.window_properties.setTitle(window_name)
+        ShowBaseGlobal.base.win.requestProperties(self.window_properties)
+        
+        # Palette texture (256 x 1): nearest filtering so entries are not blended
+        self.palette_texture = Texture("palette")
+        palette_format = Texture.F_luminance if self.palette.ndim == 1 else Texture.F_rgb8
+        self.palette_texture.setup2dTexture(256, 1, Texture.T_unsigned_byte, palette_format)
+        self.palette_texture.setMagfilter(SamplerState.FT_nearest)
+        self.palette_texture.setMinfilter(SamplerState.FT_nearest)
+        self.set_palette_image()
+        
+        # Interpolating between indices would mix unrelated colors, so no filtering for index map
+        self.index_texture = self.index_tex.texture
+        self.index_texture.setMagfilter(SamplerState.FT_nearest)
+        self.index_texture.setMinfilter(SamplerState.FT_nearest)
+        
+        cm = CardMaker('card')
+        cm.setFrameFullscreenQuad()
+        self.card = self.aspect2d.attachNewNode(cm.generate())
+        self.use_shader = self.win.getGsg().getSupportsBasicShaders()
+        if self.use_shader:
+            shader = Shader.make(Shader.SL_GLSL, palette_vertex_shader, palette_fragment_shader)
+            self.card.setShader(shader)
+            self.card.setShaderInput("index_map", self.index_texture)
+            self.card.setShaderInput("palette", self.palette_texture)
+        else:
+            logger.warning("PaletteStim: no shader support, applying palette on the CPU")
+            self.index_array = self.index_tex.texture_array  # once: it may not be kept (keep_ram)
+            index_height, index_width = self.index_array.shape
+            self.frame_texture = Texture("palette_frame")
+            self.frame_texture.setup2dTexture(index_width, index_height,
+                                              Texture.T_unsigned_byte, palette_format)
+            self.set_frame_image()
+            self.card.setTexture(self.frame_texture)
+        
+        if self.velocity != 0:
+            self.taskMgr.add(self.rotate_palette_task, "rotate_palette")
+            
+    def set_palette_image(self):
+        utils.set_ram_image(self.palette_texture, self.rotated_palette[None])
+            
+    def set_frame_image(self):
+        # Look up colors straight into the frame texture's memory (both in panda3d's order)
+        frame_array = utils.native_order(utils.ram_image_array(self.frame_texture))
+        native_palette = utils.native_order(self.rotated_palette[None])[0]
+        np.take(native_palette, self.index_array, axis = 0, out = frame_array)
+    
+    def rotate_palette_task(self, task):
+        """
+        Rotate palette by velocity cycles per second (in whole palette entries).
+        """
+        shift = int(task.time*self.velocity*256) % 256
+        if shift != self.palette_shift:
+            self.palette_shift = shift
+            # rotated_palette[i] = palette[i - shift], without allocating a new array
+            self.rotated_palette[shift:] = self.palette[: 256 - shift]
+            self.rotated_palette[: shift] = self.palette[256 - shift :]
+            self.set_palette_image()
+            if not self.use_shader:
+                self.set_frame_image()
+        return Task.cont
+    
+    
+class CubeStim(ShowBase):
+    """
+    Plays the frames of a textures.CubeTex as an animation, at frame_rate frames
+    per second (looping). The cube is loaded onto the graphics card once, as a 3d
+    texture, and each new frame only moves the card's w texture coordinate to
+    that frame's slice. So nothing is uploaded during playback, and the frame rate
+    does not depend on the frame size. If the graphics card can't use 3d textures,
+    each new frame is copied into a 2d texture instead (and uploaded).
+    
+    Usage:
+        cube_tex = textures.CubeTex(utils.TextureBank('radial_sin_cube.bank'))
+        cube_stim = CubeStim(cube_tex, frame_rate = 30)
+        cube_stim.run()
+    """
+    def __init__(self, cube_tex, frame_rate = 30, fps = 30, window_size = None, 
+                 window_name = "CubeStim", profile_on = False):
+        super().__init__()
+        utils.configure_npot(self.win.getGsg())
+        self.cube_tex = cube_tex
+        self.frame_rate = frame_rate
+        self.frame = None
+        self.window_size = self.cube_tex.texture_size if window_size is None else window_size
+        self.window_name = window_name
+        
+        # Set frame rate
+        ShowBaseGlobal.globalClock.setMode(ClockObject.MLimited)
+        ShowBaseGlobal.globalClock.setFrameRate(fps) 
+        
+        #Set up profiling if desired
+        if profile_on:
+            PStatClient.connect() # this will only work if pstats is running: see readme
+            ShowBaseGlobal.base.setFrameRateMeter(True)  #Show frame rate
+            
+        #Window properties set up 
+        self.window_properties = WindowProperties()
+        self.window_properties.setSize(self.window_size, self.window_size)
+        self.window_properties.setTitle(window_name)
+        ShowBaseGlobal.base.win.requestProperties(self.window_properties)
+        
+        self.texture_stage = TextureStage("cube_stage")
+        cm = CardMaker('card')
+        cm.setFrameFullscreenQuad()
+        self.card = self.aspect2d.attachNewNode(cm.generate())
+        self.card.setColor(self.cube_tex.tint)
+        self.use_3d_texture = self.win.getGsg().getSupports3dTexture()
+        if self.use_3d_texture:
+            self.card.setTexture(self.texture_stage, self.cube_tex.texture)
+            self.card.setTexScale(self.texture_stage, *self.cube_tex.frame_scale)  # in case frames are padded
+        else:
+            logger.warning("CubeStim: no 3d texture support, uploading each frame as a 2d texture")
+            frame_height, frame_width = self.cube_tex.texture_array.shape[1:3]
+            texture_format = Texture.F_luminance if self.cube_tex.texture_array.ndim == 3 else Texture.F_rgb8
+            self.frame_texture = Texture("cube_frame")
+            self.frame_texture.setup2dTexture(utils.upload_size(frame_width), utils.upload_size(frame_height), 
+                                              Texture.T_unsigned_byte, texture_format)
+            self.card.setTexture(self.texture_stage, self.frame_texture)
+            self.card.setTexScale(self.texture_stage, frame_width/self.frame_texture.getXSize(), 
+                                  frame_height/self.frame_texture.getYSize())  # in case frames are padded
+        self.set_frame(0)
+        
+        if self.frame_rate != 0:
+            self.taskMgr.add(self.play_cube_task, "play_cube")
+            
+    def set_frame(self, frame):
+        """
+        Show frame (modulo the number of frames).
+        """
+        self.frame = frame % self.cube_tex.num_frames
+        if self.use_3d_texture:
+            self.card.setTexPos(self.texture_stage, 0, 0, self.cube_tex.frame_w(self.frame))  #u, v, w
+        else:
+            padded_shape = (self.frame_texture.getYSize(), self.frame_texture.getXSize())
+            utils.set_ram_image(self.frame_texture, 
+                                utils.pad_power_of_two(self.cube_tex.texture_array[self.frame], padded_shape))
+        
+    def play_cube_task(self, task):
+        frame = int(task.time*self.frame_rate) % self.cube_tex.num_frames
+        if frame != self.frame:
+            self.set_frame(frame)
+        return Task.cont
+    
+    
+class NoiseStim(ShowBase):
+    """
+    Shows a textures.NoiseTex as noise that changes frame_rate times per second.
+    Each new frame only moves the card's texture to a random offset (whole pixels,
+    wrapping around): a single transform update, with no new noise made or 
+    uploaded. The window shows window_size x window_size pixels of the noise.
+    
+    Offsets come from offset_generator(offset_seed, ...), with offset_seed random
+    if None, so with the noise texture's seed they determine every frame: frame n
+    is noise_tex.window(offsets[n], window_size). Both seeds are logged, the offset
+    of each frame shown is kept in self.offsets, and if save_path is given each
+    frame is also written there (time, frame number, x and y offsets).
+    
+    Usage:
+        noise_tex = textures.NoiseTex(texture_size = 2048, noise_type = 'binary', seed = 1)
+        noise_stim = NoiseStim(noise_tex, frame_rate = 20, offset_seed = 2, save_path = 'noise.txt')
+        noise_stim.run()
+    """
+    def __init__(self, noise_tex, frame_rate = 30, fps = 30, window_size = 512, offset_seed = None,
+                 window_name = "NoiseStim", profile_on = False, save_path = None):
+        super().__init__()
+        utils.configure_npot(self.win.getGsg())
+        self.noise_tex = noise_tex
+        self.frame_rate = frame_rate
+        self.window_size = window_size
+        self.window_name = window_name
+        self.offset_seed = int(np.random.default_rng().integers(2**32)) if offset_seed is None else offset_seed
+        self.offset_iterator = self.offset_generator(self.offset_seed, self.noise_tex.texture_size)
+        self.offsets = []  # (x, y) offset of each frame shown, in pixels
+        self.frame = 0
+        logger.info("NoiseStim: %s, offset seed %d", self.noise_tex, self.offset_seed)
+        if save_path:
+            self.filestream = utils.save_initialize(save_path, [self.noise_tex], 
+                                                    [{'seed': self.noise_tex.seed, 'offset_seed': self.offset_seed,
+                                                      'window_size': self.window_size}])
+        else:
+            self.filestream = None
+        
+        # Set frame rate
+        ShowBaseGlobal.globalClock.setMode(ClockObject.MLimited)
+        ShowBaseGlobal.globalClock.setFrameRate(fps) 
+        
+        #Set up profiling if desired
+        if profile_on:
+            PStatClient.connect() # this will only work if pstats is running: see readme
+            ShowBaseGlobal.base.setFrameRateMeter(True)  #Show frame rate
+            
+        #Window properties set up 
+        self.window_properties = WindowProperties()
+        self.window_properties.setSize(self.window_size, self.window_size)
+        self.window_properties.setTitle(window_name)
+        ShowBaseGlobal.base.win.requestProperties(self.window_properties)
+        
+        # The card covers window_size pixels of the noise: one texel per screen pixel
+        self.texture_stage = TextureStage("noise_stage")
+        cm = CardMaker('card')
+        cm.setFrameFullscreenQuad()
+        self.card = self.aspect2d.attachNewNode(cm.generate())
+        self.card.setColor(self.noise_tex.tint)
+        self.card.setTexture(self.texture_stage, self.noise_tex.texture)
+        self.card.setTexScale(self.texture_stage, self.window_size/self.noise_tex.texture_size)
+        self.next_frame()
+        
+        if self.frame_rate != 0:
+            self.taskMgr.add(self.play_noise_task, "play_noise")
+            
+    @staticmethod
+    def offset_generator(offset_seed, texture_size):
+        """
+        Yields the (x, y) offsets (pixels) of successive frames for offset_seed: 
+        e.g., list(itertools.islice(NoiseStim.offset_generator(seed, size), n)) 
+        gives the offsets of the first n frames.
+        """
+        rng = np.random.default_rng(offset_seed)
+        while True:
+            yield tuple(int(offset) for offset in rng.integers(0, texture_size, size = 2))
+            
+    def next_frame(self):
+        """
+        Show the noise at the next offset.
+        """
+        x, y = next(self.offset_iterator)
+        self.offsets.append((x, y))
+        texture_size = self.noise_tex.texture_size
+        self.card.setTexPos(self.texture_stage, x/texture_size, y/texture_size, 0)  #u, v, w
+        if self.filestream:
+            self.filestream.write(f"{str(datetime.now())}\t{len(self.offsets) - 1}\t{x}\t{y}\n")
+            self.filestream.flush()
+        
+    def play_noise_task(self, task):
+        frame = int(task.time*self.frame_rate)
+        if frame != self.frame:
+            self.frame = frame
+            self.next_frame()
+        return Task.cont
+    
+    
+class ProducerStim(ShowBase):
+    """
+    Shows frames that are computed as they are shown, by a utils.FrameProducer
+    whose frame generator runs in a separate process (started here if it hasn't
+    been). Each render frame, the newest complete frame is copied into the card's
+    texture and uploaded, if there is a new one, so a slow generator lowers the 
+    stimulus' frame rate without slowing rendering. Produced, consumed and dropped
+    frame counts are logged every report_interval seconds, and when the window 
+    is closed (which also stops the producer).
+    
+    Usage:
+        producer = utils.FrameProducer(gray_scott_frames, (256, 256), frame_rate = 60)
+        producer_stim = ProducerStim(producer, fps = 60, window_size = 512)
+        producer_stim.run()
+    """
+    def __init__(self, frame_producer, fps = 30, window_size = None, window_name = "ProducerStim", 
+                 profile_on = False, report_interval = 10):
+        super().__init__()
+        utils.configure_npot(self.win.getGsg())
+        self.frame_producer = frame_producer
+        frame_height, frame_width = self.frame_producer.frame_shape[:2]
+        self.window_size = frame_width if window_size is None else window_size
+        self.window_name = window_name
+        self.report_interval = report_interval
+        self.next_report = report_interval
+        
+        # Set frame rate
+        ShowBaseGlobal.globalClock.setMode(ClockObject.MLimited)
+        ShowBaseGlobal.globalClock.setFrameRate(fps) 
+        
+        #Set up profiling if desired
+        if profile_on:
+            PStatClient.connect() # this will only work if pstats is running: see readme
+            ShowBaseGlobal.base.setFrameRateMeter(True)  #Show frame rate
+            
+        #Window properties set up 
+        self.window_properties = WindowProperties()
+        self.window_properties.setSize(self.window_size, self.window_size)
+        self.window_properties.setTitle(window_name)
+        ShowBaseGlobal.base.win.requestProperties(self.window_properties)
+        
+        texture_format = Texture.F_rgb8 if len(self.frame_producer.frame_shape) == 3 else Texture.F_luminance
+        self.frame_texture = Texture("producer_frame")
+        self.frame_texture.setup2dTexture(frame_width, frame_height, Texture.T_unsigned_byte, texture_format)
+        self.texture_stage = TextureStage("producer_stage")
+        cm = CardMaker('card')
+        cm.setFrameFullscreenQuad()
+        self.card = self.aspect2d.attachNewNode(cm.generate())
+        self.card.setTexture(self.texture_stage, self.frame_texture)
+        
+        if self.frame_producer.process is None:
+            self.frame_producer.start()
+        self.finalExitCallbacks.append(self.stop_producer)
+        self.taskMgr.add(self.show_newest_task, "show_newest")
+        
+    def upload_frame(self, frame):
+        utils.set_ram_image(self.frame_texture, frame)
+        
+    def show_newest_task(self, task):
+        self.frame_producer.consume_newest(self.upload_frame)
+        if self.report_interval and task.time >= self.next_report:
+            logger.info("%s", self.frame_producer)
+            self.next_report += self.report_interval
+        return Task.cont
+    
+    def stop_producer(self):
+        self.frame_producer.stop()
+        logger.info("%s", self.frame_producer)
+        
+        
 class OpenLoopStim(ShowBase):
     """
     Takes in list of stimuli, and params, as well as list of values/durations to show
@@ -535,6 +929,7 @@ class KeyboardToggleTex(ShowBase):
     def __init__(self, tex_classes, stim_params, window_size = 512, 
                  profile_on = False, fps = 30, save_path = None):
         super().__init__()
+        utils.configure_npot(self.win.getGsg())
 
         self.tex_classes = tex_classes
         self.current_tex_num = 0
@@ -609,8 +1004,9 @@ class KeyboardToggleTex(ShowBase):
         logger.info(self.current_tex_num, self.current_stim_params)
         self.tex = self.tex_classes[self.current_tex_num]
 
-        self.card.setColor((1, 1, 1, 1))
+        self.card.setColor(self.tex.tint)
         self.card.setTexture(self.texture_stage, self.tex.texture)
+        self.card.setTexScale(self.texture_stage, self.tex.uv_scale)
         self.card.setTexRotate(self.texture_stage, self.current_stim_params['angle'])
         other_stim = 1 if self.current_tex_num == 0 else 0
         self.set_title(f"Press {other_stim} to switch")
@@ -624,7 +1020,7 @@ class KeyboardToggleTex(ShowBase):
         if self.current_stim_params['velocity'] == 0:
             pass
         else:
-            new_position = -task.time*self.current_stim_params['velocity']
+            new_position = -task.time*self.current_stim_params['velocity']*self.tex.uv_scale
             self.card.setTexPos(self.texture_stage, new_position, 0, 0) #u, v, w
         return task.cont 
 
@@ -650,10 +1046,22 @@ class InputControlStim(ShowBase):
             profile_on (False): will show actual fps, profiler, and little x at center if True
             fps (30): controls frame rate of display
             save_path (None): if set to a file path, will save data about stimuli, and time they are delivered
+            texture_budget (None): if set, bytes of video memory textures can use (see utils.TextureResidency):
+                least-recently-shown textures are released, and 'prefetch0' etc events re-prepare them
+            warm_up (False): if True, build and render every stimulus once offscreen before the first 
+                one is shown, so no texture upload happens at a switch (see warm_up_stimuli())
     """
+    # Attributes that hold the cards, stages, and masks built for each type of stimulus
+    stimulus_attributes = {'b': ('left_card', 'right_card', 'left_texture_stage', 'right_texture_stage',
+                                 'left_mask', 'right_mask', 'left_mask_stage', 'right_mask_stage',
+                                 'left_mask_array', 'right_mask_array', 'mask_position_uv', 'mask_transform'),
+                           's': ('card', 'texture_stage')}
+    
     def __init__(self, tex_classes, stim_params, initial_tex_ind = 0, window_size = 512, 
-                 window_name = "InputControlStim", profile_on = False, fps = 30, save_path = None):
+                 window_name = "InputControlStim", profile_on = False, fps = 30, save_path = None,
+                 texture_budget = None, warm_up = False):
         super().__init__()
+        utils.configure_npot(self.win.getGsg())
 
         self.current_tex_num = initial_tex_ind
         self.previous_tex_num = None
@@ -684,6 +1092,18 @@ class InputControlStim(ShowBase):
         if self.profile_on:
             PStatClient.connect() # this will only work if pstats is running
             ShowBaseGlobal.base.setFrameRateMeter(True)  #Show frame rate
+        
+        # Keep textures in video memory within budget
+        if texture_budget is not None:
+            self.residency = utils.TextureResidency(self.win.getGsg(), budget_bytes = texture_budget)
+        else:
+            self.residency = None
+        
+        # Build every stimulus ahead of time if desired
+        self.stimulus_nodes = {}  # tex index: attributes built for that stimulus
+        self.warm_up_times = {}
+        if warm_up:
+            self.warm_up_stimuli()
                        
         #Set initial texture(s)
         self.set_stimulus(str(self.current_tex_num))
@@ -692,6 +1112,9 @@ class InputControlStim(ShowBase):
         self.accept('stim0', self.set_stimulus, ['0']) 
         self.accept('stim1', self.set_stimulus, ['1'])
         self.accept('stim2', self.set_stimulus, ['2'])
+        self.accept('prefetch0', self.prefetch_stimulus, ['0'])
+        self.accept('prefetch1', self.prefetch_stimulus, ['1'])
+        self.accept('prefetch2', self.prefetch_stimulus, ['2'])
         # Wrinkle: should we set this here or there?
         self.taskMgr.add(self.move_textures, "move textures")
 
@@ -702,8 +1125,8 @@ class InputControlStim(ShowBase):
     #Move textures
     def move_textures(self, task):
         if self.current_stim_params['stim_type'] == 'b':
-            left_tex_position =  -task.time*self.current_stim_params['velocities'][0] #negative b/c texture stage
-            right_tex_position = -task.time*self.current_stim_params['velocities'][1]
+            left_tex_position =  -task.time*self.current_stim_params['velocities'][0]*self.tex.uv_scale #negative b/c texture stage
+            right_tex_position = -task.time*self.current_stim_params['velocities'][1]*self.tex.uv_scale
             try:
                 self.left_card.setTexPos(self.left_texture_stage, left_tex_position, 0, 0)
                 self.right_card.setTexPos(self.right_texture_stage, right_tex_position, 0, 0)
@@ -713,7 +1136,7 @@ class InputControlStim(ShowBase):
             if self.current_stim_params['velocity'] == 0:
                 pass
             else:
-                new_position = -task.time*self.current_stim_params['velocity']
+                new_position = -task.time*self.current_stim_params['velocity']*self.tex.uv_scale
                 # Sometimes setting position fails when the texture stage isn't fully set
                 try:
                     self.card.setTexPos(self.texture_stage, new_position, 0, 0) #u, v, w
@@ -745,9 +1168,11 @@ class InputControlStim(ShowBase):
             self.setBackgroundColor((0,0,0,1))  # without this the cards will appear washed out
             self.left_card = self.aspect2d.attachNewNode(cardmaker.generate())
             self.left_card.setAttrib(ColorBlendAttrib.make(ColorBlendAttrib.M_add)) # otherwise only right card shows
+            self.left_card.setColor(self.tex.tint)
     
             self.right_card = self.aspect2d.attachNewNode(cardmaker.generate())
             self.right_card.setAttrib(ColorBlendAttrib.make(ColorBlendAttrib.M_add))
+            self.right_card.setColor(self.tex.tint)
             if self.profile_on:
                 self.center_indicator = OnscreenText("x",
                                                      style = 1,
@@ -758,7 +1183,7 @@ class InputControlStim(ShowBase):
         # Tex card
         elif self.current_stim_params['stim_type'] == 's':
             self.card = self.aspect2d.attachNewNode(cardmaker.generate())
-            self.card.setColor((1, 1, 1, 1)) #?
+            self.card.setColor(self.tex.tint)  # texture is multiplied by this color
             self.card.setScale(self.scale)
         return
         
@@ -818,16 +1243,104 @@ class InputControlStim(ShowBase):
         self.tex = self.tex_classes[self.current_tex_num]
         
         logger.debug("\t%d: %s", self.current_tex_num, self.tex)
-        self.create_texture_stages()
-        self.create_cards()
-        self.set_texture_stages()
-        self.set_transforms()
+        if self.residency:
+            self.residency.show(self.tex)
+            logger.debug("\t%s", self.residency)
+        if self.current_tex_num in self.stimulus_nodes:
+            self.restore_stimulus()
+        else:
+            self.build_stimulus()
         #Save stim to file (put this last as you want to set transforms quickly)
         if self.filestream:
             self.filestream.write(f"{str(datetime.now())}\t{data}\n")
             self.filestream.flush()
         return
     
+    def build_stimulus(self):
+        """
+        Create texture stages and cards for the current stimulus, and set up its textures.
+        """
+        self.create_texture_stages()
+        self.create_cards()
+        self.set_texture_stages()
+        self.set_transforms()
+        return
+    
+    def stimulus_cards(self):
+        """
+        Nodes shown for the current stimulus (the ones clear_cards() detaches)
+        """
+        if self.current_stim_params['stim_type'] == 'b':
+            cards = [self.left_card, self.right_card]
+            if self.profile_on:
+                cards.append(self.center_indicator)
+        elif self.current_stim_params['stim_type'] == 's':
+            cards = [self.card]
+        return cards
+    
+    def restore_stimulus(self):
+        """
+        Show the cards built for the current stimulus by warm_up_stimuli(), 
+        instead of building them again.
+        """
+        for attribute, value in self.stimulus_nodes[self.current_tex_num].items():
+            setattr(self, attribute, value)
+        for card in self.stimulus_cards():
+            card.reparentTo(self.aspect2d)
+        return
+    
+    def warm_up_stimuli(self):
+        """
+        Build every stimulus and render it once into an offscreen buffer that shares 
+        the window's gsg, so its textures are uploaded and its render state is set up
+        before the first trial. The cards are kept, and reattached when the stimulus
+        is shown. Warm-up time for each stimulus (seconds) is logged and stored in 
+        warm_up_times.
+        """
+        gsg = self.win.getGsg()
+        warm_up_buffer = self.win.makeTextureBuffer("warm_up_buffer", self.window_size, self.window_size)
+        warm_up_root = NodePath("warm_up_root")
+        warm_up_root.setState(self.render2d.getState())  # same render state as window
+        warm_up_camera = self.makeCamera2d(warm_up_buffer)
+        warm_up_camera.reparentTo(warm_up_root)
+        
+        initial_tex_num = self.current_tex_num
+        for tex_num, tex in enumerate(self.tex_classes):
+            start_time = time.perf_counter()
+            self.current_tex_num = tex_num
+            self.tex = tex
+            if self.residency:
+                self.residency.prefetch(self.tex)
+            else:
+                self.tex.prepare(gsg)
+            self.build_stimulus()
+            cards = self.stimulus_cards()
+            for card in cards:
+                card.reparentTo(warm_up_root)
+            self.graphicsEngine.renderFrame()
+            for card in cards:
+                card.detachNode()
+            attributes = self.stimulus_attributes[self.current_stim_params['stim_type']]
+            if self.profile_on and self.current_stim_params['stim_type'] == 'b':
+                attributes = attributes + ('center_indicator',)
+            self.stimulus_nodes[tex_num] = {attribute: getattr(self, attribute) for attribute in attributes}
+            self.warm_up_times[tex_num] = time.perf_counter() - start_time
+            logger.info("Warm-up %d (%s): %.1f ms", tex_num, tex, 1000*self.warm_up_times[tex_num])
+            
+        self.current_tex_num = initial_tex_num
+        warm_up_camera.removeNode()
+        self.graphicsEngine.removeWindow(warm_up_buffer)
+        return self.warm_up_times
+    
+    def prefetch_stimulus(self, data):
+        """
+        Re-prepare texture for stimulus data ahead of a scheduled switch to it, 
+        so it is back in video memory when shown (only used with texture_budget).
+        """
+        if self.residency:
+            self.residency.prefetch(self.tex_classes[int(data)])
+        return
+    
     def clear_cards(self):
         """ 
         Clear cards when new stimulus: stim-class sensitive
@@ -852,14 +1365,15 @@ class InputControlStim(ShowBase):
             self.left_card.setTexTransform(self.left_mask_stage, self.mask_transform)
             self.right_card.setTexTransform(self.right_mask_stage, self.mask_transform)
             #Left texture
-            self.left_card.setTexScale(self.left_texture_stage, 1/self.scale)
+            self.left_card.setTexScale(self.left_texture_stage, self.tex.uv_scale/self.scale)
             self.left_card.setTexRotate(self.left_texture_stage, self.current_stim_params['angles'][0])
 
             #Right texture
-            self.right_card.setTexScale(self.right_texture_stage, 1/self.scale)
+            self.right_card.setTexScale(self.right_texture_stage, self.tex.uv_scale/self.scale)
             self.right_card.setTexRotate(self.right_texture_stage, self.current_stim_params['angles'][1])
             
         if self.current_stim_params['stim_type'] == 's':
+            self.card.setTexScale(self.texture_stage, self.tex.uv_scale)
             self.card.setTexRotate(self.texture_stage, self.current_stim_params['angle'])
         return
           
@@ -880,7 +1394,7 @@ class InputControlStim(ShowBase):
             self.right_mask_array[:, : self.texture_size//2 + self.current_stim_params['strip_width']//2] = 0
     
             #ADD TEXTURE STAGES TO CARDS
-            self.left_mask.setRamImage(self.left_mask_array)
+            utils.set_ram_image(self.left_mask, self.left_mask_array)
             self.left_card.setTexture(self.left_texture_stage, self.tex.texture)
             self.left_card.setTexture(self.left_mask_stage, self.left_mask)
             #Multiply the texture stages together
@@ -889,7 +1403,7 @@ class InputControlStim(ShowBase):
                                                TextureStage.COSrcColor,
                                                TextureStage.CSPrevious,
                                                TextureStage.COSrcColor)
-            self.right_mask.setRamImage(self.right_mask_array)
+            utils.set_ram_image(self.right_mask, self.right_mask_array)
             self.right_card.setTexture(self.right_texture_stage, self.tex.texture)
             self.right_card.setTexture(self.right_mask_stage, self.right_mask)
             #Multiply the texture stages together
@@ -929,6 +1443,7 @@ class Scaling(ShowBase):
     """
     def __init__(self, texture_array, scale = 0.2, window_size = 512, texture_size = 512):
         super().__init__()
+        utils.configure_npot(self.win.getGsg())
         self.scale = scale
         self.texture_array = texture_array
         self.texture_dtype = type(self.texture_array.flat[0])
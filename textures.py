@@ -11,35 +11,329 @@ in each subclass as a numpy array that looks how you want.
 Component types (texture data types in panda3d):
 https://www.panda3d.org/reference/python/classpanda3d_1_1core_1_1Texture.html#a81f78fc173dedefe5a049c0aa3eed2c0
 """
+import os
+import math
+import hashlib
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory, resource_tracker
 import numpy as np
 import matplotlib.pyplot as plt
-from panda3d.core import Texture
+from PIL import Image
+from panda3d.core import Texture, TransformState, SamplerState
 
 import utils 
+import shapes
 
 class TextureBase:
     """
     Base class for stimuli: subclass this when making specific stimuli.
     You need to implement the create_texture() method, and any parameters
-    needed for the texture function.
+    needed for the texture function. If you want the texture to be cacheable,
+    also override the params property so it returns those parameters.
+
+    Caching:
+        Pass a utils.TextureCache as cache, and the texture array will be loaded
+        from disk if a texture of the same class, version, size and params was 
+        made before (otherwise it is created and stored in the cache). Bump the 
+        version class attribute of a subclass when you change its create_texture()
+        so stale arrays are not loaded.
+        
+    Compact textures:
+        A texture array can hold just a repeating piece of the full texture_size 
+        x texture_size image: uv_scale is how many times it repeats across the
+        full image. Stimulus classes multiply their texture transforms by uv_scale,
+        so with repeat wrapping the card looks the same as with the full array.
+        
+    Lazy textures:
+        If lazy is True, construction only stores the parameters. The array and 
+        panda3d texture are made the first time texture_array or texture is used 
+        (e.g., when the texture is put on a card), or when you call prepare().
+        
+    Interning:
+        If intern is True, textures with the same content_id share one array and 
+        panda3d Texture (see TextureRegistry), so listing the same texture for 
+        several stimuli costs memory and build time only once.
+        
+    Tint:
+        Stimulus classes set their cards' color to tint (r, g, b, a in [0, 1]), 
+        which multiplies the texture when it is drawn. So a grayscale texture with
+        a tint shows up in color, and only needs one channel in memory.
+        
+    Dynamic textures:
+        To change a texture every frame without allocating new arrays, write the
+        next frame into back_array() (a numpy view of a second panda3d texture's 
+        memory), then call swap_buffers() and put the returned texture on the card.
+        The texture being drawn is never the one being written. texture_array 
+        keeps the initial frame.
+        
+    Non-power-of-two textures:
+        Graphics cards that can use non-power-of-two (npot) textures get them at 
+        their exact size (see utils.configure_npot). For the rest, textures whose 
+        picture doesn't depend on pixel units (scalable, e.g. gratings with so many
+        cycles per texture) are made at the next power-of-two size (array_size),
+        and other arrays are padded to it when loaded, with uv_scale shrunk so 
+        cards still show only the original texture. Support is detected when the
+        first stimulus window opens (stimulus classes call utils.configure_npot), 
+        so to be sure textures made before that fit the card, make them lazy, 
+        or call utils.configure_npot yourself once there is a window.
+        
+    Keeping ram copies:
+        By default the array is kept in texture_array, and panda3d keeps its own 
+        copy (the texture's ram image). With keep_ram False, both are dropped once 
+        the texture is loaded onto the graphics card (panda3d's setKeepRamImage(False)),
+        so static stimuli use about half the host memory. They are only made again 
+        (from the cache if there is one, otherwise with create_texture()) when needed:
+        texture_array (e.g., for view()) then returns a new array each time, and 
+        restore_ram_image() reloads the texture if it was released from the card
+        (prepare() and utils.TextureResidency call it). Such textures can't be dynamic.
     """
-    def __init__(self, texture_size = 512, texture_name = "stimulus"):
+    version = 1
+    tint = (1, 1, 1, 1)
+    scalable = False  # True if create_texture() makes the same picture at any array_size
+    
+    def __init__(self, texture_size = 512, texture_name = "stimulus", cache = None, lazy = False, 
+                 intern = False, keep_ram = True):
         self.texture_size = texture_size
         self.texture_name = texture_name
-        # Create texture
-        self.texture_array = self.create_texture()
-        self.texture = Texture(self.texture_name)
+        self.cache = cache
+        self.intern = intern
+        self.keep_ram = keep_ram
+        self._registry_finalizer = None
+        self._texture_array = None
+        self._array_shape = None
+        self._array_size = None
+        self._texture = None
+        self._back_texture = None
+        self._back_array = None
+        self._front_array = None
+        if not lazy:
+            self.prepare()
+            
+    @property
+    def texture_array(self):
+        """
+        Numpy array for the texture (created on first use). If it was dropped 
+        (keep_ram False), a new one is made each time.
+        """
+        if self._texture_array is None:
+            if self.intern:
+                registry.acquire(self)
+            elif self._texture is None:
+                self._texture_array = self.load_texture()
+            if self._texture_array is None:
+                return self.load_texture()
+        return self._texture_array
+    
+    @property
+    def array_shape(self):
+        """
+        Shape of texture_array (remembered when the array is dropped).
+        """
+        if self._texture_array is None and self._array_shape is not None:
+            return self._array_shape
+        return self.texture_array.shape
+    
+    @property
+    def texture(self):
+        """
+        panda3d Texture holding texture_array (created on first use).
+        """
+        if self._texture is None:
+            if self.intern:
+                registry.acquire(self)
+            else:
+                texture_array = self.texture_array
+                self._array_shape = texture_array.shape
+                self._texture = self.make_texture(texture_array)
+                if not self.keep_ram:
+                    self._texture.setKeepRamImage(False)  # dropped once loaded onto the card
+                    self._texture_array = None
+        return self._texture
+    
+    @property
+    def is_prepared(self):
+        return self._texture is not None
+    
+    def prepare(self, gsg = None):
+        """
+        Create the texture array and panda3d texture now, instead of on first use.
+        If a GraphicsStateGuardian is given (e.g., base.win.getGsg()), also queue
+        the texture to be loaded onto the graphics card.
+        """
+        texture = self.texture
+        if gsg is not None and not texture.isPrepared(gsg.getPreparedObjects()):
+            self.restore_ram_image()
+            texture.prepare(gsg.getPreparedObjects())
+        return self
+    
+    def restore_ram_image(self):
+        """
+        Make the texture's ram image again if panda3d dropped it after loading 
+        the texture onto the graphics card (keep_ram False), so the texture can be 
+        loaded again: e.g., after it was released from the card, or the graphics 
+        context was reset. Does nothing if the ram image is there.
+        """
+        if self._texture is not None and not self._texture.hasRamImage():
+            self.load_ram_image(self._texture, self.texture_array)
+        return self
+    
+    @staticmethod
+    def ram_image_array(texture):
+        """
+        Writable numpy view of the memory of panda3d Texture texture, shaped like
+        texture_array (see utils.ram_image_array). Write into it, then call 
+        texture.modifyRamImage() so the texture is loaded onto the graphics card
+        again before the next frame.
+        """
+        return utils.ram_image_array(texture)
+    
+    def back_array(self):
+        """
+        Writable view of the back buffer: the texture that will be shown after the
+        next swap_buffers(). The same array is returned until then, so generators 
+        can write into it every frame without allocating.
+        """
+        if self.intern:
+            raise ValueError("Interned textures are shared, so can't be changed: use intern = False")
+        if not self.keep_ram:
+            raise ValueError("Dynamic textures need their ram image: use keep_ram = True")
+        if self._back_texture is None:
+            self._back_texture = utils.copy_texture(self.texture)  # own memory, unlike makeCopy()
+            self._back_array = self.ram_image_array(self._back_texture)
+            self._front_array = self.ram_image_array(self.texture)
+        return self._back_array
+    
+    def swap_buffers(self):
+        """
+        Show what was written into back_array(): returns the new front texture 
+        (put it on the card with setTexture), and the old one becomes the back buffer.
+        """
+        self.back_array()
+        self._back_texture.modifyRamImage()  # mark as changed so it is uploaded again
+        self._texture, self._back_texture = self._back_texture, self._texture
+        self._front_array, self._back_array = self._back_array, self._front_array
+        return self._texture
+            
+    @property
+    def spec(self):
+        """
+        TextureSpec that can recreate this texture (e.g., in another process).
+        """
+        return TextureSpec(type(self), texture_size = self.texture_size, 
+                           texture_name = self.texture_name, **self.params)
+    
+    @classmethod
+    def from_array(cls, texture_array, lazy = False, **kwargs):
+        """
+        Make a texture with parameters kwargs whose array has already been 
+        computed (e.g., by batch()), so create_texture() is not called.
+        """
+        tex = cls(lazy = True, **kwargs)
+        tex._texture_array = texture_array
+        if not lazy:
+            tex.prepare()
+        return tex
+            
+    def make_texture(self, texture_array):
+        """
+        Create a panda3d Texture from the texture array. The array is copied 
+        straight into the texture's memory: texture classes make rgb arrays with
+        utils.empty_rgb() so no conversion to panda3d's bgr order is needed.
+        """
+        texture = Texture(self.texture_name)
+        # Cards that need power-of-two textures get padded arrays (see uv_scale)
+        height, width = (utils.upload_size(size) for size in texture_array.shape[:2])
         # Set texture formatting (greyscale or rgb have different settings)
-        if self.texture_array.ndim == 2:
-            self.texture.setup2dTexture(self.texture_size, self.texture_size,
-                                        Texture.T_unsigned_byte, 
-                                        Texture.F_luminance)
-            self.texture.setRamImageAs(self.texture_array, "L")
-        elif self.texture_array.ndim == 3:
-            self.texture.setup2dTexture(self.texture_size, self.texture_size,
-                                        Texture.T_unsigned_byte, 
-                                        Texture.F_rgb8)
-            self.texture.setRamImageAs(self.texture_array, "RGB")
+        if texture_array.ndim == 2:
+            texture.setup2dTexture(width, height,
+                                   Texture.T_unsigned_byte, 
+                                   Texture.F_luminance)
+        elif texture_array.ndim == 3:
+            texture.setup2dTexture(width, height,
+                                   Texture.T_unsigned_byte, 
+                                   Texture.F_rgb8)
+        return self.load_ram_image(texture, texture_array)
+    
+    def load_ram_image(self, texture, texture_array):
+        """
+        Copy texture_array into the ram image of texture (made by make_texture()),
+        padded to the texture's size (a power of two if the graphics card needs one).
+        """
+        padded_shape = (texture.getYSize(), texture.getXSize())
+        return utils.set_ram_image(texture, utils.pad_power_of_two(texture_array, padded_shape))
+
+    @property
+    def params(self):
+        """
+        Dictionary of the parameters (besides texture_size) of the texture.
+        Keys should be the keyword arguments of __init__.
+        """
+        return {}
+    
+    @property
+    def content_params(self):
+        """
+        The params that determine the texture array: used to make cache keys. 
+        Override if some params (e.g., tint) do not change the array.
+        """
+        return self.params
+    
+    @property
+    def content_id(self):
+        """
+        Hashable description of the texture array: class, version, size and content_params.
+        """
+        return (type(self).__qualname__, self.version, self.array_size, 
+                repr(sorted(self.content_params.items())))
+    
+    def variant(self, **params):
+        """
+        Copy of this texture with some params changed, sharing the same array and
+        panda3d Texture. Only for params that don't change the array, e.g., rgb 
+        of luminance SinRgbTex textures.
+        """
+        spec = self.spec
+        tex = TextureSpec(spec.tex_class, **{**spec.kwargs, **params}).make(lazy = True, cache = self.cache,
+                                                                         intern = self.intern, 
+                                                                         keep_ram = self.keep_ram)
+        if tex.content_params != self.content_params:
+            raise ValueError(f"variant(): {params} would change the texture array")
+        if self.intern:
+            registry.acquire(tex)
+        else:
+            tex._texture = self.texture
+            tex._texture_array = self._texture_array
+            tex._array_shape = self.array_shape
+        return tex
+    
+    def apply_lut(self, lut, lut_name = None):
+        """
+        Return LutTex of this texture transformed by lut (e.g., from utils.intensity_lut). 
+        The result is remembered, so asking for the same lut again is free.
+        """
+        lut = np.asarray(lut, dtype = np.uint8)
+        if '_lut_variants' not in self.__dict__:
+            self._lut_variants = {}
+        lut_key = lut.tobytes()
+        if lut_key not in self._lut_variants:
+            self._lut_variants[lut_key] = LutTex(self, lut, lut_name = lut_name, cache = self.cache, 
+                                                 intern = self.intern, keep_ram = self.keep_ram)
+        return self._lut_variants[lut_key]
+
+    def load_texture(self):
+        """
+        Return the texture array: from the cache if possible, otherwise
+        using create_texture() (and storing the result in the cache).
+        """
+        if self.cache is None:
+            return self.create_texture()
+        key = self.cache.make_key(self)
+        texture_array = self.cache.get(key)
+        if texture_array is None:
+            texture_array = self.create_texture()
+            self.cache.put(key, texture_array)
+        return texture_array
 
     def create_texture(self):
         """ 
@@ -51,13 +345,52 @@ class TextureBase:
         """
         Plot the texture using matplotlib. Useful for debugging.
         """
-        plt.imshow(self.texture_array, vmin = 0, vmax = 255)
-        if self.texture_array.ndim == 2:
+        image = self.full_array()
+        if tuple(self.tint[:3]) != (1, 1, 1):
+            image = np.uint8(image[..., None]*np.array(self.tint[:3])) if image.ndim == 2 else image
+        plt.imshow(image, vmin = 0, vmax = 255)
+        if image.ndim == 2:
             plt.set_cmap('gray')
             
         plt.title(self.texture_name)
         plt.show()
         
+    @property
+    def array_size(self):
+        """
+        Size of the full image the texture array holds: texture_size, except for 
+        scalable textures, which are made at utils.upload_size(texture_size). It is 
+        fixed the first time it is needed, so it doesn't change if non-power-of-two
+        support is detected later (see utils.npot_supported).
+        """
+        if self._array_size is None:
+            self._array_size = utils.upload_size(self.texture_size) if self.scalable else self.texture_size
+        return self._array_size
+    
+    @property
+    def uv_scale(self):
+        """
+        Number of times the texture array repeats across the full texture (times the 
+        fraction of the loaded texture it fills, if it is padded to a power of two).
+        """
+        width = self.array_shape[1]
+        repeats = self.array_size//width
+        padded_width = self.texture.getXSize()  # as padded by make_texture()
+        if padded_width != width:
+            return repeats*width/padded_width
+        return repeats
+    
+    def full_array(self):
+        """
+        The full array_size x array_size image (tiles compact texture arrays).
+        """
+        texture_array = self.texture_array
+        height, width = texture_array.shape[:2]
+        if (height, width) == (self.array_size, self.array_size):
+            return texture_array
+        reps = (self.array_size//height, self.array_size//width) + (1,)*(texture_array.ndim - 2)
+        return np.tile(texture_array, reps)
+        
     def __str__(self):
         """
         Return the string you want print(Tex) to show, and to save to file 
@@ -66,21 +399,324 @@ class TextureBase:
         pass
     
 
+class TextureSpec:
+    """
+    Picklable recipe for a texture: texture class plus keyword arguments. Unlike
+    texture objects (which hold a panda3d Texture), specs can be sent to other 
+    processes: see build_textures().
+    
+    Usage:
+        spec = TextureSpec(SinGrayTex, texture_size = 1024, spatial_frequency = 20)
+        sin_tex = spec.make()
+    """
+    def __init__(self, tex_class, **kwargs):
+        self.tex_class = tex_class
+        self.kwargs = kwargs
+        
+    def make(self, **kwargs):
+        """
+        Create the texture object: kwargs (e.g., lazy, cache) are added to those of the spec.
+        """
+        return self.tex_class(**self.kwargs, **kwargs)
+    
+    def create_array(self):
+        """
+        Only compute the texture array (no panda3d Texture is made).
+        """
+        return self.make(lazy = True).create_texture()
+    
+    def __repr__(self):
+        return f"{type(self).__name__}({self.tex_class.__name__}, {self.kwargs})"
+    
+    
+class TextureRegistry:
+    """
+    Process-wide registry of interned textures (textures.registry): texture 
+    objects made with intern = True that have the same content_id (class, 
+    version, size and content_params) share one array and one panda3d Texture,
+    which is only built the first time it is asked for. So GPU memory and build
+    time depend on the number of unique textures, not on how many stimuli use them.
+    
+    Entries are reference counted: each texture object using an entry holds one
+    reference, dropped when the object is garbage collected or release()d. When 
+    no texture uses an entry it is removed, and its Texture released from the 
+    graphics card. An entry keeps its array and ram image if any of its textures
+    has keep_ram True (see TextureBase).
+    
+    Usage:
+        sin_tex = textures.SinGrayTex(spatial_frequency = 20, intern = True)
+        same_tex = textures.SinGrayTex(spatial_frequency = 20, intern = True)  # not rebuilt
+        
+    Note:
+        Interned textures share their panda3d Texture, so settings made on it
+        (e.g., filters) apply to all of them, and they can't be dynamic (see 
+        TextureBase.back_array()).
+    """
+    def __init__(self):
+        self.entries = {}  # content_id: [texture_array (None if dropped), texture, reference count, array shape]
+        self.hits = 0
+        self.misses = 0
+        
+    def __contains__(self, tex):
+        return tex.content_id in self.entries
+    
+    def __len__(self):
+        return len(self.entries)
+        
+    def acquire(self, tex):
+        """
+        Give texture object tex the shared array and Texture for its content_id, 
+        making them (from tex) if no other texture has.
+        """
+        if tex._registry_finalizer is not None:
+            return
+        key = tex.content_id
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            texture_array = tex._texture_array
+            if texture_array is None:
+                texture_array = tex.load_texture()
+            texture = tex.make_texture(texture_array)
+            if not tex.keep_ram:
+                texture.setKeepRamImage(False)
+            entry = [texture_array if tex.keep_ram else None, texture, 0, texture_array.shape]
+            self.entries[key] = entry
+        else:
+            self.hits += 1
+            if tex.keep_ram and entry[0] is None:
+                # the first users dropped the array (keep_ram False): keep it from now on
+                entry[0] = tex._texture_array if tex._texture_array is not None else tex.load_texture()
+                entry[1].setKeepRamImage(True)
+                if not entry[1].hasRamImage():
+                    tex.load_ram_image(entry[1], entry[0])
+        entry[2] += 1
+        tex._texture_array, tex._texture, tex._array_shape = entry[0], entry[1], entry[3]
+        tex._registry_finalizer = weakref.finalize(tex, self.release_key, key)
+        tex._registry_finalizer.atexit = False  # panda3d may be gone by then
+        
+    def release(self, tex):
+        """
+        Drop tex's reference to its entry now, rather than when it is garbage collected.
+        """
+        if tex._registry_finalizer is not None:
+            tex._registry_finalizer()
+            tex._registry_finalizer = None
+            tex._texture_array = None
+            tex._texture = None
+            
+    def release_key(self, key):
+        entry = self.entries[key]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self.entries[key]
+            entry[1].releaseAll()
+            
+    def __str__(self):
+        return f"{type(self).__name__} textures:{len(self.entries)} hits:{self.hits} misses:{self.misses}"
+    
+    
+registry = TextureRegistry()
+
+
+def build_textures(specs, max_workers = None, cache = None, lazy = False, intern = False, keep_ram = True):
+    """
+    Create texture objects from a list of TextureSpecs, computing their arrays in 
+    parallel in a pool of max_workers processes (default: one per core). Arrays 
+    are passed back through shared memory, and the panda3d Textures are made in 
+    this process. If a utils.TextureCache is given, cached arrays are loaded 
+    instead of recomputed, and new arrays are added to the cache. Specs with the
+    same content are only computed once; with intern, they also share one 
+    panda3d Texture, and ones already in the registry are not computed at all.
+    With keep_ram False, arrays are dropped once loaded (see TextureBase).
+    
+    Note on Windows/macOS the calling script needs an if __name__ == '__main__' guard.
+    """
+    texs = [spec.make(cache = cache, lazy = True, intern = intern, keep_ram = keep_ram) for spec in specs]
+    pending = []
+    duplicates = []
+    unique_texs = {}  # content_id: first tex with that content
+    for tex in texs:
+        if intern and tex in registry:
+            continue
+        if tex.content_id in unique_texs:
+            duplicates.append(tex)
+            continue
+        unique_texs[tex.content_id] = tex
+        cached_array = cache.get(cache.make_key(tex)) if cache is not None else None
+        if cached_array is None:
+            pending.append(tex)
+        else:
+            tex._texture_array = cached_array
+    if pending:
+        if os.name == 'posix':
+            # Workers must share our resource tracker, or it will complain about 
+            # (and try to free) blocks that they created and we freed.
+            resource_tracker.ensure_running()
+        with ProcessPoolExecutor(max_workers = max_workers) as pool:
+            futures = {pool.submit(create_shared_array, tex.spec, utils.npot_supported()): tex 
+                       for tex in pending}
+            for future in as_completed(futures):
+                tex = futures[future]
+                tex._texture_array = load_shared_array(*future.result())
+                if cache is not None:
+                    cache.put(cache.make_key(tex), tex._texture_array)
+    for tex in duplicates:
+        tex._texture_array = unique_texs[tex.content_id]._texture_array
+    if not lazy:
+        for tex in texs:
+            tex.prepare()
+    return texs
+
+
+def create_shared_array(spec, npot_supported = True):
+    """
+    Worker for build_textures(): compute the array for spec into a new shared
+    memory block, and return the (name, shape, dtype) needed to read it. 
+    npot_supported is passed on from the main process, which has the window.
+    """
+    utils.NPOT_SUPPORTED = npot_supported
+    array = utils.native_order(spec.create_array())  # so memory is in panda3d's order
+    shared_block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+    shared_array = np.ndarray(array.shape, dtype = array.dtype, buffer = shared_block.buf)
+    shared_array[...] = array
+    del shared_array
+    shared_block.close()
+    return shared_block.name, array.shape, array.dtype.str
+
+
+def load_shared_array(name, shape, dtype):
+    """
+    Copy array out of the shared memory block made by create_shared_array(), and free the block.
+    """
+    shared_block = shared_memory.SharedMemory(name = name)
+    array = np.ndarray(shape, dtype = dtype, buffer = shared_block.buf).copy()
+    shared_block.close()
+    shared_block.unlink()
+    return utils.native_order(array)
+    
+
+def periodic_strip(row, frequency):
+    """
+    For textures that vary only along x, with frequency cycles across the row: 
+    return the narrowest leading piece of row that tiles it exactly (the whole 
+    row if frequency is not an integer, or rounding makes the cycles differ).
+    """
+    texture_size = row.shape[1]
+    if float(frequency).is_integer() and frequency > 0:
+        repeats = math.gcd(texture_size, int(frequency))
+        strip = row[:, : texture_size//repeats]
+        reps = (1, repeats) + (1,)*(row.ndim - 2)
+        if np.array_equal(np.tile(strip, reps), row):
+            return utils.as_native(strip, copy = True)
+    return row
+
+
+def sweep_rows(waveform, texture_size, frequencies, phases):
+    """
+    First rows (N x 1 x array size) of waveform (utils.sin_byte or 
+    utils.grating_byte) for the N frequencies and phases, computed in one
+    broadcast pass over the shared x grid (utils.grids). The rows span the array_size
+    of the textures (utils.upload_size(texture_size), see TextureBase).
+    """
+    x, _ = utils.grids.get(utils.upload_size(texture_size), 'cartesian')
+    return waveform(x[None], freq = frequencies[:, None, None], 
+                    phase = phases[:, None, None])
+
+
+def waveform_array(waveform, texture_size, frequency, phase, rgb = None, compact = False):
+    """
+    Array for textures that only vary along x (sinusoids and gratings): waveform
+    (utils.sin_byte or utils.grating_byte) is computed for a single row, scaled 
+    from black to rgb if given, and broadcast into every row of a preallocated
+    uint8 array (or cut to a strip by periodic_strip() if compact). So peak memory 
+    is the output plus a few rows, whatever the texture size.
+    """
+    x, _ = utils.grids.get(texture_size, 'cartesian')
+    row = waveform(x, freq = frequency, phase = phase)
+    if rgb is not None:
+        gray_row = row
+        row = utils.empty_rgb(gray_row.shape)
+        row[..., 0] = np.uint8((rgb[0]/255)*gray_row)
+        row[..., 1] = np.uint8((rgb[1]/255)*gray_row)
+        row[..., 2] = np.uint8((rgb[2]/255)*gray_row)
+    if compact:
+        return periodic_strip(row, frequency)
+    if row.ndim == 3:
+        array = utils.empty_rgb((texture_size, texture_size))
+    else:
+        array = np.empty((texture_size, texture_size), dtype = np.uint8)
+    array[...] = row
+    return array
+
+
+def batch_from_rows(cls, rows, param_list, texture_size = 512, compact = False, **kwargs):
+    """
+    Wrap rows from sweep_rows() into texture objects of class cls: texture i has 
+    parameters param_list[i]. Full arrays are views into one N x array size 
+    x array size stack, compact arrays are strips (see periodic_strip).
+    """
+    if compact:
+        arrays = [periodic_strip(row, params['spatial_frequency'])
+                  for row, params in zip(rows, param_list)]
+    else:
+        if rows.ndim == 4:
+            stack = utils.empty_rgb((len(rows), rows.shape[2], rows.shape[2]))
+        else:
+            stack = np.empty((len(rows), rows.shape[2], rows.shape[2]), dtype = np.uint8)
+        stack[...] = rows
+        arrays = list(stack)
+    return [cls.from_array(array, texture_size = texture_size, compact = compact, **params, **kwargs)
+            for array, params in zip(arrays, param_list)]
+    
+    
+def waveform_batch(cls, waveform, spatial_frequencies, phases = 0, rgbs = None, **kwargs):
+    """
+    batch() of the waveform texture classes: list of cls textures, one for each 
+    element of the (broadcast) arrays spatial_frequencies, phases and, for rgb 
+    classes, rgbs (N x 3), with the rows of waveform (utils.sin_byte or 
+    utils.grating_byte) computed at once by sweep_rows(). Other keyword arguments
+    are passed to each texture.
+    """
+    if rgbs is None:
+        frequencies, phases = np.broadcast_arrays(np.atleast_1d(spatial_frequencies), 
+                                                  np.atleast_1d(phases))
+    else:
+        frequencies, phases, rgbs = np.broadcast_arrays(np.atleast_1d(spatial_frequencies)[:, None], 
+                                                        np.atleast_1d(phases)[:, None], 
+                                                        np.atleast_2d(rgbs))
+        frequencies, phases = frequencies[:, 0], phases[:, 0]
+        if np.any(rgbs < 0) or np.any(rgbs > 255):
+            raise ValueError(f"{cls.__name__}.batch(): rgb values must lie in [0,255]")
+    rows = sweep_rows(waveform, kwargs.get('texture_size', 512), frequencies, phases)
+    param_list = [{'spatial_frequency': freq, 'phase': phase}
+                  for freq, phase in zip(frequencies.tolist(), phases.tolist())]
+    if rgbs is not None:
+        if not kwargs.get('luminance', True):
+            rows = np.uint8((rgbs[:, None, None, :]/255)*rows[..., None])
+        for params, rgb in zip(param_list, rgbs.tolist()):
+            params['rgb'] = tuple(rgb)
+    return batch_from_rows(cls, rows, param_list, **kwargs)
+    
+    
 class RgbTex(TextureBase):
     """
     Full field at given color (e.g., a red card).
     """
-    def __init__(self, texture_size = 512,  texture_name = "rgb_field", rgb = (0, 255, 0)):
+    scalable = True
+    
+    def __init__(self, texture_size = 512,  texture_name = "rgb_field", rgb = (0, 255, 0), **kwargs):
         self.rgb = rgb
-        super().__init__(texture_size = texture_size, texture_name = texture_name)
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+
+    @property
+    def params(self):
+        return {'rgb': self.rgb}
 
     def create_texture(self):
         if not (all([x >= 0 for x in self.rgb]) and all([x <= 255 for x in self.rgb])):
             raise ValueError("rgb values must lie in [0,255]")
-        x = np.linspace(-self.texture_size/2, self.texture_size/2, self.texture_size)
-        y = np.linspace(-self.texture_size/2, self.texture_size/2, self.texture_size)
-        X, Y = np.meshgrid(x, y)
-        rgb_texture = np.zeros((self.texture_size, self.texture_size, 3), dtype = np.uint8)
+        rgb_texture = utils.empty_rgb((self.array_size, self.array_size))
         rgb_texture[..., 0] = self.rgb[0]
         rgb_texture[..., 1] = self.rgb[1]
         rgb_texture[..., 2] = self.rgb[2]
@@ -94,28 +730,33 @@ class CircleGrayTex(TextureBase):
     """ 
     Filled circle: grayscale on grayscale with circle_radius, centered at circle_center
     with face color fg_intensity on background bg_intensity. Center position is in pixels
-    from center of image.
+    from center of image. The edge is antialiased unless antialias is False (see shapes.py).
     """
+    version = 2
+    
     def __init__(self, texture_size = 512,  texture_name = "gray_circle", circle_center = (0,0),
-                 circle_radius = 100, bg_intensity = 0, fg_intensity  = 255):
+                 circle_radius = 100, bg_intensity = 0, fg_intensity  = 255, antialias = True, **kwargs):
         self.center = circle_center
         self.radius = circle_radius
         self.bg_intensity = bg_intensity
         self.fg_intensity = fg_intensity
-        super().__init__(texture_size = texture_size, texture_name = texture_name)
+        self.antialias = antialias
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+        
+    @property
+    def params(self):
+        return {'circle_center': self.center, 'circle_radius': self.radius,
+                'bg_intensity': self.bg_intensity, 'fg_intensity': self.fg_intensity,
+                'antialias': self.antialias}
         
     def create_texture(self):
         min_int = np.min([self.fg_intensity, self.bg_intensity])
         max_int = np.max([self.fg_intensity, self.bg_intensity])
         if max_int > 255 or min_int < 0:
             raise ValueError('Circle intensity must lie in [0, 255]')
-        x = np.linspace(-self.texture_size/2, self.texture_size/2, self.texture_size)
-        y = np.linspace(-self.texture_size/2, self.texture_size/2, self.texture_size)
-        X, Y = np.meshgrid(x, y)
-        circle_texture = self.bg_intensity*np.ones((self.texture_size,self.texture_size), dtype = np.uint8)
-        circle_mask = (X - self.center[0])**2 + (Y - self.center[1])**2 <= self.radius**2
-        circle_texture[circle_mask] = self.fg_intensity
-        return np.uint8(circle_texture)
+        circle_texture = np.full((self.texture_size, self.texture_size), self.bg_intensity, dtype = np.uint8)
+        return shapes.disc(circle_texture, self.center, self.radius, 
+                           intensity = self.fg_intensity, antialias = self.antialias)
 
     def __str__(self):
         part1 =  f"{type(self).__name__} size:{self.texture_size} center:{self.center} "
@@ -125,102 +766,711 @@ class CircleGrayTex(TextureBase):
 class SinGrayTex(TextureBase):
     """
     Grayscale sinusoidal grating texture.
+    
+    If compact is True, only stores a 1-pixel-tall strip holding the smallest
+    whole number of cycles that tiles the texture exactly (see TextureBase uv_scale). 
+    Phase is in radians.
+    
+    For parameter sweeps use SinGrayTex.batch(), which is much faster than making
+    the textures one at a time.
 
     To do:
-        Currently doesn't handle phase or contrast (usually handled by ShowBase)
+        Currently doesn't handle contrast (usually handled by ShowBase)
     """
-    def __init__(self, texture_size = 512, texture_name = "sin_gray", spatial_frequency = 10):
-        self.frequency = spatial_frequency
-        super().__init__(texture_size = texture_size, texture_name = texture_name)
+    version = 2  # float32 kernels (kernels.py)
+    scalable = True
+    
+    def __init__(self, texture_size = 512, texture_name = "sin_gray", spatial_frequency = 10, 
+                 phase = 0, compact = False, **kwargs):
+        self.frequency = float(spatial_frequency)  # so batch() textures (numpy floats) get the same keys
+        self.phase = float(phase)
+        self.compact = compact
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+
+    @property
+    def params(self):
+        return {'spatial_frequency': self.frequency, 'phase': self.phase, 'compact': self.compact}
+    
+    @classmethod
+    def batch(cls, spatial_frequencies, phases = 0, **kwargs):
+        """
+        Return list of textures, one for each element of the (broadcast) arrays 
+        spatial_frequencies and phases. All arrays are computed at once 
+        (see waveform_batch). Other keyword arguments are passed to each texture.
+        """
+        return waveform_batch(cls, utils.sin_byte, spatial_frequencies, phases, **kwargs)
 
     def create_texture(self):
-        x = np.linspace(0, 2*np.pi, self.texture_size + 1)
-        y = np.linspace(0, 2*np.pi, self.texture_size + 1)
-        array, Y = np.meshgrid(x[: self.texture_size],y[: self.texture_size])
-        return utils.sin_byte(array, freq = self.frequency) 
+        return waveform_array(utils.sin_byte, self.array_size, self.frequency, self.phase, 
+                              compact = self.compact)
     
     def __str__(self):
-        return f"{type(self).__name__} size:{self.texture_size} frequency:{self.frequency}"
+        return f"{type(self).__name__} size:{self.texture_size} frequency:{self.frequency} phase:{self.phase}"
     
 class SinRgbTex(TextureBase):
     """
     Sinusoid that goes from black to the given rgb value. 
+    
+    If luminance is True (the default), the texture array is grayscale and the 
+    color comes from tint (see TextureBase), so one array can be shared by many 
+    colors (see variant()). Set it to False for an rgb texture array.
+    
+    If compact is True, only stores a 1-pixel-tall strip (see SinGrayTex).
+    For parameter sweeps use SinRgbTex.batch().
 
     To do:
-        Currently doesn't handle phase, contrast 
+        Currently doesn't handle contrast 
         Would be nice to have it cycle between two different colors, not just rgb/black.
     """
+    version = 2  # float32 kernels (kernels.py)
+    scalable = True
+    
     def __init__(self, texture_size = 512, texture_name = "sin_rgb", 
-                 spatial_frequency = 10, rgb = (255, 0, 0)):
-        self.frequency = spatial_frequency
+                 spatial_frequency = 10, rgb = (255, 0, 0), phase = 0, compact = False, 
+                 luminance = True, **kwargs):
+        self.frequency = float(spatial_frequency)  # so batch() textures (numpy floats) get the same keys
         self.rgb = rgb
-        super().__init__(texture_size = texture_size, texture_name = texture_name)
+        self.phase = float(phase)
+        self.compact = compact
+        self.luminance = luminance
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+
+    @property
+    def params(self):
+        return {'spatial_frequency': self.frequency, 'rgb': self.rgb, 'phase': self.phase, 
+                'compact': self.compact, 'luminance': self.luminance}
+    
+    @property
+    def content_params(self):
+        if self.luminance:
+            return {key: val for key, val in self.params.items() if key != 'rgb'}
+        return self.params
+    
+    @property
+    def tint(self):
+        if self.luminance:
+            return (self.rgb[0]/255, self.rgb[1]/255, self.rgb[2]/255, 1)
+        return (1, 1, 1, 1)
+    
+    @classmethod
+    def batch(cls, spatial_frequencies, phases = 0, rgbs = (255, 0, 0), **kwargs):
+        """
+        Return list of textures, one for each element of the (broadcast) arrays 
+        spatial_frequencies, phases and rgbs (N x 3). All arrays are computed at 
+        once (see waveform_batch).
+        """
+        return waveform_batch(cls, utils.sin_byte, spatial_frequencies, phases, rgbs = rgbs, **kwargs)
     
     def create_texture(self):
         if not (all([x >= 0 for x in self.rgb]) and all([x <= 255 for x in self.rgb])):
             raise ValueError("SinRgbTex.sin_texture_rgb(): rgb values must lie in [0,255]")
-        x = np.linspace(0, 2*np.pi, self.texture_size+1)
-        y = np.linspace(0, 2*np.pi, self.texture_size+1)
-        array, Y = np.meshgrid(x[: self.texture_size],y[: self.texture_size])
-        R = np.uint8((self.rgb[0]/255)*utils.sin_byte(array, freq = self.frequency))
-        G = np.uint8((self.rgb[1]/255)*utils.sin_byte(array, freq = self.frequency))
-        B = np.uint8((self.rgb[2]/255)*utils.sin_byte(array, freq = self.frequency))
-        rgb_sin = np.zeros((self.texture_size, self.texture_size, 3), dtype = np.uint8)
-        rgb_sin[...,0] = R
-        rgb_sin[...,1] = G
-        rgb_sin[...,2] = B
-        return rgb_sin
+        rgb = None if self.luminance else self.rgb
+        return waveform_array(utils.sin_byte, self.array_size, self.frequency, self.phase, 
+                              rgb = rgb, compact = self.compact)
     
     def __str__(self):
-        return f"{type(self).__name__} size:{self.texture_size} frequency:{self.frequency} rgb:{self.rgb}"
+        return f"{type(self).__name__} size:{self.texture_size} frequency:{self.frequency} rgb:{self.rgb} phase:{self.phase}"
     
     
 class GratingGrayTex(TextureBase):
     """
     Grayscale 2d square wave (grating)
+    
+    If compact is True, only stores a 1-pixel-tall strip (see SinGrayTex).
+    For parameter sweeps use GratingGrayTex.batch().
     """
+    version = 2  # float32 kernels (kernels.py)
+    scalable = True
+    
     def __init__(self, texture_size = 512,  texture_name = "grating_gray", 
-                 spatial_frequency = 10):
-        self.frequency = spatial_frequency
-        super().__init__(texture_size = texture_size, texture_name = texture_name)
+                 spatial_frequency = 10, phase = 0, compact = False, **kwargs):
+        self.frequency = float(spatial_frequency)  # so batch() textures (numpy floats) get the same keys
+        self.phase = float(phase)
+        self.compact = compact
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+
+    @property
+    def params(self):
+        return {'spatial_frequency': self.frequency, 'phase': self.phase, 'compact': self.compact}
+    
+    @classmethod
+    def batch(cls, spatial_frequencies, phases = 0, **kwargs):
+        """
+        Return list of textures, one for each element of the (broadcast) arrays 
+        spatial_frequencies and phases. All arrays are computed at once 
+        (see waveform_batch). Other keyword arguments are passed to each texture.
+        """
+        return waveform_batch(cls, utils.grating_byte, spatial_frequencies, phases, **kwargs)
     
     def create_texture(self):
-        x = np.linspace(0, 2*np.pi, self.texture_size+1)
-        y = np.linspace(0, 2*np.pi, self.texture_size+1)
-        X, Y = np.meshgrid(x[: self.texture_size],y[: self.texture_size])
-        return utils.grating_byte(X, freq = self.frequency)
+        return waveform_array(utils.grating_byte, self.array_size, self.frequency, self.phase, 
+                              compact = self.compact)
     
     def __str__(self):
-        return f"{type(self).__name__} size:{self.texture_size} frequency:{self.frequency}"
+        return f"{type(self).__name__} size:{self.texture_size} frequency:{self.frequency} phase:{self.phase}"
     
     
 class GratingRgbTex(TextureBase):
     """
     Rgb 2d square wave (grating) stimulus class (goes from black to rgb val)
+    
+    If luminance is True (the default), the texture array is grayscale and the 
+    color comes from tint (see SinRgbTex). 
+    If compact is True, only stores a 1-pixel-tall strip (see SinGrayTex).
+    For parameter sweeps use GratingRgbTex.batch().
+    
     To do:
         Could make it alternate b/w two rgb values.
     """
+    version = 2  # float32 kernels (kernels.py)
+    scalable = True
+    
     def __init__(self, texture_size = 512, texture_name = "grating_rgb", 
-                 spatial_frequency = 10, rgb = (255, 0, 0)):
-        self.frequency = spatial_frequency
+                 spatial_frequency = 10, rgb = (255, 0, 0), phase = 0, compact = False, 
+                 luminance = True, **kwargs):
+        self.frequency = float(spatial_frequency)  # so batch() textures (numpy floats) get the same keys
         self.rgb = rgb
-        super().__init__(texture_size = texture_size, texture_name = texture_name)
+        self.phase = float(phase)
+        self.compact = compact
+        self.luminance = luminance
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+
+    @property
+    def params(self):
+        return {'spatial_frequency': self.frequency, 'rgb': self.rgb, 'phase': self.phase, 
+                'compact': self.compact, 'luminance': self.luminance}
+    
+    @property
+    def content_params(self):
+        if self.luminance:
+            return {key: val for key, val in self.params.items() if key != 'rgb'}
+        return self.params
+    
+    @property
+    def tint(self):
+        if self.luminance:
+            return (self.rgb[0]/255, self.rgb[1]/255, self.rgb[2]/255, 1)
+        return (1, 1, 1, 1)
+    
+    @classmethod
+    def batch(cls, spatial_frequencies, phases = 0, rgbs = (255, 0, 0), **kwargs):
+        """
+        Return list of textures, one for each element of the (broadcast) arrays 
+        spatial_frequencies, phases and rgbs (N x 3). All arrays are computed at 
+        once (see waveform_batch).
+        """
+        return waveform_batch(cls, utils.grating_byte, spatial_frequencies, phases, rgbs = rgbs, **kwargs)
+    
+    def create_texture(self):
+        rgb = None if self.luminance else self.rgb
+        return waveform_array(utils.grating_byte, self.array_size, self.frequency, self.phase, 
+                              rgb = rgb, compact = self.compact)
+        
+    def __str__(self):
+        return f"{type(self).__name__} size:{self.texture_size} frequency:{self.frequency} rgb:{self.rgb} phase:{self.phase}"
+    
+
+class BankTex(TextureBase):
+    """
+    Texture whose array is a frame of a utils.TextureBank (memory-mapped file of
+    frames): frames are read from disk only when shown. Use set_frame() to 
+    show a different frame, e.g., in a task for animations (it copies into the
+    back buffer without allocating, then swaps).
+    
+    To make a bank from texture classes, write their arrays once:
+        utils.TextureBank.write(path, (tex.texture_array for tex in SinGrayTex.batch(freqs)))
+    """
+    def __init__(self, bank_path, frame = 0, texture_size = None, texture_name = "bank", **kwargs):
+        self.bank_path = bank_path
+        self.bank = utils.TextureBank(bank_path)
+        self.frame = frame
+        if texture_size is None:
+            texture_size = self.bank.shape[2]
+        elif texture_size != self.bank.shape[2]:
+            raise ValueError(f"texture_size {texture_size} does not match bank width {self.bank.shape[2]}")
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+        
+    @property
+    def params(self):
+        return {'bank_path': self.bank_path, 'frame': self.frame}
+    
+    @property
+    def content_params(self):
+        return {**self.bank.file_state, 'frame': self.frame}
+    
+    def create_texture(self):
+        return self.bank[self.frame]
+    
+    def set_frame(self, frame):
+        """
+        Copy frame (modulo the number of frames) from the bank straight into the 
+        back buffer and swap (see swap_buffers()): returns the texture to put on the card.
+        """
+        self.frame = frame % len(self.bank)
+        self._texture_array = self.bank[self.frame]
+        height, width = self._texture_array.shape[:2]  # back array may be padded (see make_texture)
+        np.copyto(utils.native_order(self.back_array()[:height, :width]), utils.native_order(self._texture_array))
+        return self.swap_buffers()
+            
+    def __str__(self):
+        return f"{type(self).__name__} size:{self.texture_size} bank:{self.bank_path} frame:{self.frame}"
+    
+    
+class CubeTex(TextureBase):
+    """
+    Stack of frames (e.g., one cycle of a drifting grating) loaded as a single
+    panda3d 3d texture, with one frame per slice along the w texture coordinate.
+    stimuli.CubeStim animates it by moving w to the next frame's slice
+    (see frame_w()), so after the one upload no pixels are sent to the graphics
+    card, however large the frames.
+    
+    frames is an n x height x width (x 3) uint8 array, or a utils.TextureBank,
+    whose frames are copied into the texture straight from the file.
+    texture_array is then the whole stack.
+    
+    Usage:
+        cube_tex = CubeTex(utils.TextureBank('radial_sin_cube.bank'))
+        card.setTexture(texture_stage, cube_tex.texture)
+        card.setTexPos(texture_stage, 0, 0, cube_tex.frame_w(10))  # show frame 10
+        
+    Note(s):
+        Filtering is nearest, because panda3d filters all three axes alike, 
+        and linear filtering or mipmaps would blend neighboring frames.
+        On graphics cards without non-power-of-two support each dimension is 
+        padded to a power of two (see TextureBase), and frame_w() and 
+        frame_scale() account for it.
+    """
+    def __init__(self, frames, texture_size = None, texture_name = "cube", **kwargs):
+        if not isinstance(frames, utils.TextureBank):
+            frames = np.asarray(frames, dtype = np.uint8)
+        self.frames = frames
+        if texture_size is None:
+            texture_size = frames.shape[2]
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+        
+    @property
+    def params(self):
+        return {'frames': self.frames}
+    
+    @property
+    def content_params(self):
+        if isinstance(self.frames, utils.TextureBank):
+            return self.frames.file_state
+        return {'frames': hashlib.sha1(np.ascontiguousarray(self.frames)).hexdigest()}
+    
+    @property
+    def num_frames(self):
+        return self.frames.shape[0]
+    
+    def frame_w(self, frame):
+        """
+        w texture coordinate of the center of the slice holding frame (modulo num_frames).
+        """
+        return (frame % self.num_frames + 0.5)/self.texture.getZSize()  # depth may be padded
+    
+    @property
+    def frame_scale(self):
+        """
+        (u, v) texture scale that shows just the frames, without any padding.
+        """
+        frame_height, frame_width = self.array_shape[1:3]
+        return frame_width/self.texture.getXSize(), frame_height/self.texture.getYSize()
+    
+    def create_texture(self):
+        if isinstance(self.frames, utils.TextureBank):
+            return self.frames.frames
+        return self.frames
+    
+    def make_texture(self, texture_array):
+        """
+        Create a panda3d 3d Texture holding the frames, copying them one slice at a time. 
+        """
+        texture = Texture(self.texture_name)
+        # Cards that need power-of-two textures get padded frames (see frame_scale)
+        num_frames, height, width = (utils.upload_size(size) for size in texture_array.shape[:3])
+        texture_format = Texture.F_luminance if texture_array.ndim == 3 else Texture.F_rgb8
+        texture.setup3dTexture(width, height, num_frames, Texture.T_unsigned_byte, texture_format)
+        texture.setMagfilter(SamplerState.FT_nearest)
+        texture.setMinfilter(SamplerState.FT_nearest)
+        return self.load_ram_image(texture, texture_array)
+    
+    def load_ram_image(self, texture, texture_array):
+        """
+        Copy the frames into the slices of texture, one at a time (padded to 
+        the slice size if needed). Slices past the last frame are left as they are.
+        """
+        for page, frame in zip(utils.ram_image_array(texture), texture_array):
+            frame = utils.pad_power_of_two(frame, page.shape[:2])
+            np.copyto(utils.native_order(page), utils.native_order(frame))
+        return texture
+    
+    def full_array(self):
+        """
+        The first frame (e.g., for view()).
+        """
+        return self.texture_array[0]
+            
+    def __str__(self):
+        return f"{type(self).__name__} size:{self.texture_size} frames:{self.num_frames}"
+    
+    
+class LutTex(TextureBase):
+    """
+    Texture made by passing another texture's array through a 256-entry lookup 
+    table (see utils.intensity_lut): a single np.take, with no float math, so 
+    contrast series or gamma-corrected versions of a texture are cheap. Usually
+    made with base_tex.apply_lut(lut).
+    """
+    def __init__(self, base_tex, lut, lut_name = None, texture_size = None, texture_name = None, **kwargs):
+        self.base_tex = base_tex
+        self.lut = np.asarray(lut, dtype = np.uint8)
+        if self.lut.shape != (256,):
+            raise ValueError(f"LutTex lut must have 256 entries, not shape {self.lut.shape}")
+        self.lut_name = lut_name if lut_name else hashlib.sha1(self.lut.tobytes()).hexdigest()[:8]
+        if texture_size is None:
+            texture_size = base_tex.texture_size
+        if texture_name is None:
+            texture_name = f"{base_tex.texture_name}_lut"
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+        
+    @property
+    def params(self):
+        return {'base_tex': self.base_tex, 'lut': self.lut, 'lut_name': self.lut_name}
+    
+    @property
+    def content_params(self):
+        return {'base': self.base_tex.content_id,
+                'lut': hashlib.sha1(self.lut.tobytes()).hexdigest()}
+    
+    @property
+    def tint(self):
+        return self.base_tex.tint
+    
+    @property
+    def scalable(self):
+        return self.base_tex.scalable  # array is made from the base texture's
+    
+    @property
+    def array_size(self):
+        return self.base_tex.array_size
+    
+    def create_texture(self):
+        # index with the base array in memory order, so the result is too
+        return utils.native_order(np.take(self.lut, utils.native_order(self.base_tex.texture_array)))
+    
+    def __str__(self):
+        return f"{type(self).__name__} lut:{self.lut_name} base:({self.base_tex})"
+    
+    
+class IndexMapTex(TextureBase):
+    """
+    Index texture for palette animation (see stimuli.PaletteStim): each pixel is an
+    index (0-255) into a 256-entry color table, which covers one cycle of the pattern.
+    map_type 'radius' gives concentric rings, period pixels apart; 'angle' gives a 
+    radial (pinwheel) pattern with cycles per revolution. Center is in pixels from
+    the center of the image.
+    """
+    BAND_PIXELS = 1 << 16  # pixels computed at once by create_texture()
+    
+    def __init__(self, texture_size = 512, texture_name = "index_map", map_type = 'radius', 
+                 period = 32, cycles = 8, center = (0, 0), **kwargs):
+        if map_type not in ('radius', 'angle'):
+            raise ValueError(f"IndexMapTex map_type must be 'radius' or 'angle', not {map_type}")
+        self.map_type = map_type
+        self.period = period
+        self.cycles = cycles
+        self.center = center
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+        
+    @property
+    def params(self):
+        return {'map_type': self.map_type, 'period': self.period, 'cycles': self.cycles,
+                'center': self.center}
+    
+    def create_texture(self):
+        x, y = utils.grids.get(self.texture_size, 'pixel')
+        x = x - self.center[0]
+        y = y - self.center[1]
+        index_map = np.empty((self.texture_size, self.texture_size), dtype = np.uint8)
+        # a band of rows at a time, so temporary float arrays stay small
+        band_rows = max(self.BAND_PIXELS//self.texture_size, 1)
+        for row_start in range(0, self.texture_size, band_rows):
+            band_y = y[row_start: row_start + band_rows]
+            if self.map_type == 'radius':
+                cycle_position = np.hypot(x, band_y)/self.period
+            else:
+                cycle_position = self.cycles*np.arctan2(band_y, x)/(2*np.pi)
+            index_map[row_start: row_start + band_rows] = np.floor(cycle_position*256) % 256
+        return index_map
+    
+    def __str__(self):
+        if self.map_type == 'radius':
+            return f"{type(self).__name__} size:{self.texture_size} radius period:{self.period} center:{self.center}"
+        return f"{type(self).__name__} size:{self.texture_size} angle cycles:{self.cycles} center:{self.center}"
+    
+    
+class AtlasTex(TextureBase):
+    """
+    Atlas: packs the arrays of many small textures (e.g., CircleGrayTex) into one 
+    square texture, so switching a card between them only changes its texture 
+    transform: there is no texture rebinding or uploading. 
+    
+    Members must all be grayscale or all rgb. Each member is surrounded by padding
+    pixels copied from its edges, so filtering doesn't bleed in from neighbors.
+    Members can't repeat (wrap), so this is for textures that don't drift.
+    
+    Usage:
+        atlas = AtlasTex([circle_tex1, circle_tex2, circle_tex3])
+        card.setTexture(texture_stage, atlas.texture)
+        atlas.apply(card, texture_stage, 2)  # show circle_tex3
+    """
+    def __init__(self, member_texs, padding = 2, texture_name = "atlas", texture_size = None, **kwargs):
+        self.member_texs = list(member_texs)
+        self.padding = padding
+        if len({tex.texture_array.ndim for tex in self.member_texs}) != 1:
+            raise ValueError("AtlasTex members must be all grayscale or all rgb")
+        atlas_size, self.rects = self.pack([tex.full_array().shape[:2] for tex in self.member_texs], 
+                                           padding)
+        super().__init__(texture_size = atlas_size, texture_name = texture_name, **kwargs)
+        self.texture.setWrapU(Texture.WM_clamp)
+        self.texture.setWrapV(Texture.WM_clamp)
+        
+    @staticmethod
+    def pack(shapes, padding):
+        """
+        Shelf-pack rectangles of the given (height, width) shapes (plus padding) into
+        the smallest power-of-two square. Returns its size and the (x, y, width, 
+        height) rectangle of each shape, in pixels.
+        """
+        padded = [(height + 2*padding, width + 2*padding) for height, width in shapes]
+        atlas_size = 1
+        while atlas_size**2 < sum(height*width for height, width in padded) or \
+              atlas_size < max(max(shape) for shape in padded):
+            atlas_size *= 2
+        while True:
+            rects = [None]*len(shapes)
+            x = y = shelf_height = 0
+            for ind in sorted(range(len(shapes)), key = lambda ind: -padded[ind][0]):
+                height, width = padded[ind]
+                if x + width > atlas_size:
+                    x, y, shelf_height = 0, y + shelf_height, 0
+                rects[ind] = (x + padding, y + padding, shapes[ind][1], shapes[ind][0])
+                x += width
+                shelf_height = max(shelf_height, height)
+            if y + shelf_height <= atlas_size:
+                return atlas_size, rects
+            atlas_size *= 2
+            
+    @property
+    def params(self):
+        return {'member_texs': self.member_texs, 'padding': self.padding}
+    
+    @property
+    def content_params(self):
+        return {'members': [tex.content_id for tex in self.member_texs], 'padding': self.padding}
     
     def create_texture(self):
-        x = np.linspace(0, 2*np.pi, self.texture_size+1)
-        y = np.linspace(0, 2*np.pi, self.texture_size+1)
-        X, Y = np.meshgrid(x[: self.texture_size],y[: self.texture_size])
-        R = np.uint8((self.rgb[0]/255)*utils.grating_byte(X, freq = self.frequency))
-        G = np.uint8((self.rgb[1]/255)*utils.grating_byte(X, freq = self.frequency))
-        B = np.uint8((self.rgb[2]/255)*utils.grating_byte(X, freq = self.frequency))
-        rgb_grating = np.zeros((self.texture_size, self.texture_size, 3), dtype = np.uint8)
-        rgb_grating[...,0] = R
-        rgb_grating[...,1] = G
-        rgb_grating[...,2] = B
-        return rgb_grating 
+        channels = self.member_texs[0].texture_array.shape[2:]
+        if channels:
+            atlas = utils.empty_rgb((self.texture_size, self.texture_size))
+        else:
+            atlas = np.empty((self.texture_size, self.texture_size), dtype = np.uint8)
+        atlas[...] = 0
+        pad = self.padding
+        for tex, (x, y, width, height) in zip(self.member_texs, self.rects):
+            pad_width = ((pad, pad), (pad, pad)) + ((0, 0),)*len(channels)
+            atlas[y - pad : y + height + pad, x - pad : x + width + pad] = np.pad(tex.full_array(), 
+                                                                                pad_width, mode = 'edge')
+        return atlas
+    
+    def uv_rect(self, index):
+        """
+        (u, v, width, height) of member index, in texture coordinates (0-1).
+        """
+        x, y, width, height = self.rects[index]
+        return (x/self.texture_size, y/self.texture_size, 
+                width/self.texture_size, height/self.texture_size)
+    
+    def transform(self, index):
+        """
+        Texture transform that maps a card's (0-1) texture coordinates onto member index.
+        """
+        u, v, width, height = self.uv_rect(index)
+        return TransformState.makePosRotateScale2d((u, v), 0, (width, height))
+    
+    def apply(self, nodepath, texture_stage, index):
+        """
+        Show member index on nodepath (which must already have the atlas texture on texture_stage).
+        """
+        nodepath.setTexTransform(texture_stage, self.transform(index))
+        nodepath.setColor(self.member_texs[index].tint)
         
     def __str__(self):
-        return f"{type(self).__name__} size:{self.texture_size} frequency:{self.frequency} rgb:{self.rgb}"
+        return f"{type(self).__name__} size:{self.texture_size} members:{len(self.member_texs)}"
+    
+    
+class ImageTex(TextureBase):
+    """
+    Texture from an image file (png, jpeg, or anything else PIL can read), resized 
+    to texture_size x texture_size (array_size, see TextureBase). If grayscale is 
+    True the image is converted to one channel (color can then come from tint), 
+    otherwise it is rgb.
+    
+    The cache key (content_params) is a hash of the file's contents, not its path, 
+    so with a utils.TextureCache a decoded image is reused across sessions until 
+    the file changes. To load many images, use ImageTex.batch(), which decodes 
+    them in parallel threads.
+    
+    Usage:
+        image_tex = ImageTex('images/forest.jpg', texture_size = 1024, cache = cache)
+        image_texs = ImageTex.batch(glob.glob('images/*.png'), cache = cache)
+    """
+    scalable = True
+    
+    def __init__(self, image_path, texture_size = 512, texture_name = None, grayscale = False, **kwargs):
+        self.image_path = image_path
+        self.grayscale = grayscale
+        self._file_hash = None
+        if texture_name is None:
+            texture_name = os.path.basename(image_path)
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+        
+    @property
+    def params(self):
+        return {'image_path': self.image_path, 'grayscale': self.grayscale}
+    
+    @property
+    def content_params(self):
+        return {'file': self.file_hash, 'grayscale': self.grayscale}
+    
+    @property
+    def file_hash(self):
+        """
+        sha1 of the image file's contents (read once).
+        """
+        if self._file_hash is None:
+            file_hash = hashlib.sha1()
+            with open(self.image_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    file_hash.update(chunk)
+            self._file_hash = file_hash.hexdigest()
+        return self._file_hash
+    
+    @classmethod
+    def batch(cls, image_paths, max_workers = None, cache = None, lazy = False, intern = False, **kwargs):
+        """
+        Return list of textures, one for each of image_paths, decoding the images 
+        in a pool of max_workers threads (PIL releases the GIL while decoding and
+        resizing). Cached images are loaded instead, and the same file listed
+        twice is decoded once. Other keyword arguments are passed to each texture.
+        """
+        texs = [cls(image_path, cache = cache, lazy = True, intern = intern, **kwargs) 
+                for image_path in image_paths]
+        with ThreadPoolExecutor(max_workers = max_workers) as pool:
+            list(pool.map(lambda tex: tex.file_hash, texs))
+            unique_texs = {}  # content_id: first tex with that content
+            for tex in texs:
+                if not (intern and tex in registry):
+                    unique_texs.setdefault(tex.content_id, tex)
+            arrays = pool.map(lambda tex: tex.load_texture(), unique_texs.values())
+            for tex, texture_array in zip(unique_texs.values(), arrays):
+                tex._texture_array = texture_array
+        for tex in texs:
+            if tex._texture_array is None and tex.content_id in unique_texs:
+                tex._texture_array = unique_texs[tex.content_id]._texture_array
+            if not lazy:
+                tex.prepare()
+        return texs
+    
+    def create_texture(self):
+        with Image.open(self.image_path) as image:
+            image = image.convert('L' if self.grayscale else 'RGB')
+            image = image.resize((self.array_size, self.array_size), Image.Resampling.LANCZOS)
+        image_array = np.asarray(image)[::-1]  # image rows go down, texture rows go up
+        if self.grayscale:
+            return np.ascontiguousarray(image_array)
+        texture_array = utils.empty_rgb(image_array.shape[:2])
+        texture_array[...] = image_array
+        return texture_array
+    
+    def __str__(self):
+        return f"{type(self).__name__} size:{self.texture_size} image:{self.image_path} grayscale:{self.grayscale}"
+    
+    
+class NoiseTex(TextureBase):
+    """
+    Large seeded noise texture for noise stimuli (white noise, random dots, flicker), 
+    shown by stimuli.NoiseStim: the noise is made once, and each frame shows a 
+    window of it at a new random offset, so no new pixels are made or uploaded 
+    during playback.
+    
+    noise_type is 'white' (intensities uniform in 0-255), 'binary' (0 or 255, 
+    equally likely) or 'dots' (255 on a fraction density of elements, 0 elsewhere).
+    Noise elements are element_size x element_size pixels. The array is fully 
+    determined by seed (if None, a random seed is picked and kept in self.seed),
+    and window() gives the pixels shown at any offset, so frames can be rebuilt.
+    
+    Usage:
+        noise_tex = NoiseTex(texture_size = 2048, noise_type = 'binary', seed = 1234)
+        frame = noise_tex.window((100, 37), 512)  # window at offset (100, 37)
+        
+    Note(s):
+        Offsets wrap around the texture, so on graphics cards without non-power-of-two
+        support texture_size should be a power of two (see TextureBase).
+        Filtering is nearest, so noise elements keep sharp edges.
+    """
+    NOISE_TYPES = ('white', 'binary', 'dots')
+    
+    def __init__(self, texture_size = 2048, texture_name = "noise", noise_type = 'white', 
+                 element_size = 1, density = 0.05, seed = None, **kwargs):
+        if noise_type not in self.NOISE_TYPES:
+            raise ValueError(f"NoiseTex noise_type must be one of {self.NOISE_TYPES}, not {noise_type}")
+        self.noise_type = noise_type
+        self.element_size = element_size
+        self.density = density
+        self.seed = int(np.random.default_rng().integers(2**32)) if seed is None else seed
+        super().__init__(texture_size = texture_size, texture_name = texture_name, **kwargs)
+        
+    @property
+    def params(self):
+        return {'noise_type': self.noise_type, 'element_size': self.element_size, 
+                'density': self.density, 'seed': self.seed}
+    
+    def create_texture(self):
+        rng = np.random.default_rng(self.seed)
+        num_elements = -(-self.texture_size//self.element_size)
+        shape = (num_elements, num_elements)
+        if self.noise_type == 'white':
+            noise = rng.integers(0, 256, size = shape, dtype = np.uint8)
+        elif self.noise_type == 'binary':
+            noise = rng.integers(0, 2, size = shape, dtype = np.uint8)*np.uint8(255)
+        else:
+            noise = (rng.random(shape, dtype = np.float32) < self.density)*np.uint8(255)
+        if self.element_size > 1:
+            noise = np.repeat(np.repeat(noise, self.element_size, axis = 0), self.element_size, axis = 1)
+            noise = np.ascontiguousarray(noise[: self.texture_size, : self.texture_size])
+        return noise
+    
+    def make_texture(self, texture_array):
+        texture = super().make_texture(texture_array)
+        texture.setMagfilter(SamplerState.FT_nearest)
+        texture.setMinfilter(SamplerState.FT_nearest)
+        return texture
+    
+    def window(self, offset, window_size):
+        """
+        window_size x window_size array of the noise starting at offset (x, y), in 
+        pixels, wrapping around the edges: the frame stimuli.NoiseStim shows for offset.
+        """
+        x, y = offset
+        cols = (x + np.arange(window_size)) % self.texture_size
+        rows = (y + np.arange(window_size)) % self.texture_size
+        return self.texture_array[rows[:, None], cols[None, :]]
+    
+    def __str__(self):
+        return (f"{type(self).__name__} size:{self.texture_size} {self.noise_type} "
+                f"element_size:{self.element_size} seed:{self.seed}")
+    
     
 #%%  
 if __name__ == '__main__':
@@ -257,3 +1507,15 @@ if __name__ == '__main__':
     elif example == 5:
         rgb_grate = GratingRgbTex(rgb = (255, 0 , 0), spatial_frequency = 20)
         rgb_grate.view()
+        
+    elif example == 6:
+        # Double buffering: writing the back buffer doesn't touch the texture being shown
+        dynamic_circ = CircleGrayTex(texture_size = 256)
+        front_image = bytes(dynamic_circ.texture.getRamImage())
+        dynamic_circ.back_array()[...] = 128
+        assert bytes(dynamic_circ.texture.getRamImage()) == front_image, "back buffer aliases front"
+        new_front = dynamic_circ.swap_buffers()
+        assert np.all(np.frombuffer(new_front.getRamImage(), dtype = np.uint8) == 128)
+        dynamic_circ.back_array()[...] = 0
+        assert np.all(np.frombuffer(new_front.getRamImage(), dtype = np.uint8) == 128), "back buffer aliases front"
+        print("Double buffering ok")
@@ -5,30 +5,65 @@ Helper functions used in multiple classes in stimulu/textures
 Part of pandastim package: https://github.com/EricThomson/pandastim
 """
 import sys
+import os
+import struct
+import hashlib
+from collections import OrderedDict
 import numpy as np
 import threading
-from scipy import signal 
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
 import zmq
 import time
+import logging
+
+import kernels
 
 from direct.showbase import DirectObject
 from direct.showbase.MessengerGlobal import messenger
+from direct.showbase import ShowBaseGlobal
+from panda3d.core import Texture, ATS_none
+
+logger = logging.getLogger(__name__)
+
+# Set to True to log a warning whenever set_ram_image() has to convert an array
+CHECK_UPLOADS = False
+
+# Whether the graphics card can use non-power-of-two textures: None until 
+# detected (see npot_supported())
+NPOT_SUPPORTED = None
 
-def sin_byte(X, freq = 1):
+def sin_byte(X, freq = 1, phase = 0):
     """
     Creates unsigned 8 bit representation of sin (T_unsigned_Byte). 
+    Computed in float32 blocks, see kernels.sin_byte.
     """
-    sin_float = np.sin(freq*X)
-    sin_transformed = (sin_float + 1)*127.5; #from 0-255
-    return np.uint8(sin_transformed)
+    return kernels.sin_byte(X, freq = freq, phase = phase)
 
-def grating_byte(X, freq = 1):
+def grating_byte(X, freq = 1, phase = 0):
     """
     Unsigned 8 bit representation of a grating (square wave)
+    Computed in float32 blocks, see kernels.square_byte.
+    """
+    return kernels.square_byte(X, freq = freq, phase = phase)
+
+def intensity_lut(contrast = 1, mean = 127.5, gamma = 1, invert = False):
+    """
+    256-entry uint8 lookup table (LUT) for transforming 8-bit textures without 
+    recomputing them (see textures.LutTex): index with the texture values.
+    
+    Values are (optionally) inverted, scaled about the middle (127.5) by contrast 
+    and centered on mean, then gamma-corrected for a display with the given gamma 
+    (out = 255*(in/255)**(1/gamma)). Results are clipped to [0, 255].
     """
-    grating_float = signal.square(X*freq)
-    grating_transformed = (grating_float + 1)*127.5; #from 0-255
-    return np.uint8(grating_transformed)
+    values = np.arange(256, dtype = np.float64)
+    if invert:
+        values = 255 - values
+    values = (values - 127.5)*contrast + mean
+    values = np.clip(values, 0, 255)
+    if gamma != 1:
+        values = 255*(values/255)**(1/gamma)
+    return np.uint8(np.round(values))
 
 def save_initialize(file_path, tex_classes, stim_params):
     """
@@ -60,8 +95,720 @@ def uv2card(val):
     Transform from texture-based uv-coordinates to card-based normalized device coordinates
     """
     return 2*val
+
+def native_order(array):
+    """
+    View of texture array (height x width, or height x width x rgb) in the 
+    order panda3d stores it: rgb textures are stored as bgr, so for them this is
+    array[..., ::-1]. Applying it twice gives back the original array.
+    """
+    return array[..., ::-1] if array.ndim == 3 else array
+
+def empty_rgb(shape):
+    """
+    Empty uint8 rgb array (shape + (3,)) whose memory is bgr, panda3d's order:
+    fill it as rgb, and it uploads without conversion (see set_ram_image).
+    """
+    return np.empty(tuple(shape) + (3,), dtype = np.uint8)[..., ::-1]
+
+def as_native(array, copy = False):
+    """
+    Texture array with the same values whose memory is laid out as panda3d's ram 
+    image (C-contiguous in native_order): array itself if it already is, unless copy.
+    """
+    native_array = native_order(array)
+    if copy or not native_array.flags.c_contiguous:
+        native_array = np.array(native_array, dtype = np.uint8, order = 'C')
+    return native_order(native_array)
+
+def ram_image_array(texture):
+    """
+    Writable numpy view of the memory of panda3d Texture texture, shaped like
+    a texture array (rgb for color textures: native_order() of it is the bgr
+    memory). Getting it marks the texture as modified, so what is written into
+    it is loaded onto the graphics card before the next frame. For 3d textures
+    the view has a leading axis of pages (depth x height x width (x 3)).
+    """
+    image_array = np.frombuffer(memoryview(texture.modifyRamImage()), dtype = np.uint8)
+    shape = (texture.getYSize(), texture.getXSize())
+    if texture.getTextureType() == Texture.TT_3d_texture:
+        shape = (texture.getZSize(),) + shape
+    if texture.getNumComponents() == 1:
+        return image_array.reshape(shape)
+    return image_array.reshape(shape + (texture.getNumComponents(),))[..., ::-1]
+
+def is_power_of_two(size):
+    return size > 0 and size & (size - 1) == 0
+
+def configure_npot(gsg):
+    """
+    Find out if the graphics card of gsg (e.g., base.win.getGsg()) can use 
+    non-power-of-two (npot) textures, and set up texture loading for it. 
     
+    If it can, panda3d is told never to rescale textures (textures-power-2 none), 
+    so they are loaded at their exact size. If not, texture classes make 
+    power-of-two arrays instead (see textures.TextureBase), and a warning is 
+    logged, as panda3d will resample any other npot texture when loading it.
+    """
+    global NPOT_SUPPORTED
+    NPOT_SUPPORTED = bool(gsg.getSupportsTexNonPow2())
+    if NPOT_SUPPORTED:
+        Texture.setTexturesPower2(ATS_none)
+    else:
+        logger.warning("Graphics card can't use non-power-of-two textures: texture arrays "
+                       "will be made or padded to power-of-two sizes, and panda3d will "
+                       "resample other non-power-of-two textures when loading them")
+    return NPOT_SUPPORTED
+
+def npot_supported():
+    """
+    Whether non-power-of-two textures can be loaded as they are. Detected with 
+    configure_npot() when a stimulus class opens its window, or from the window
+    of the running ShowBase the first time it is needed. Until there is a window
+    they are assumed to be (as on all but very old graphics cards).
+    """
+    if NPOT_SUPPORTED is None:
+        base = getattr(ShowBaseGlobal, 'base', None)
+        if base is None or base.win is None:
+            return True
+        return configure_npot(base.win.getGsg())
+    return NPOT_SUPPORTED
+
+def upload_size(size):
+    """
+    Size at which a texture dimension of size pixels is loaded onto the graphics 
+    card: size itself, or the next power of two if the card needs one.
+    """
+    if is_power_of_two(size) or npot_supported():
+        return size
+    return 1 << (int(size) - 1).bit_length()
+
+def pad_power_of_two(texture_array, padded_shape = None):
+    """
+    Texture array padded to upload_size() height and width (or to padded_shape, 
+    e.g. the size of the texture it goes into) by repeating its last row and 
+    column (so filtering at its edges is unchanged), with the same layout as 
+    empty_rgb(). Returns texture_array itself if no padding is needed.
+    """
+    height, width = texture_array.shape[:2]
+    if padded_shape is None:
+        padded_shape = (upload_size(height), upload_size(width))
+    pad_height, pad_width = padded_shape[0] - height, padded_shape[1] - width
+    if pad_height == 0 and pad_width == 0:
+        return texture_array
+    pad_widths = ((0, pad_height), (0, pad_width)) + ((0, 0),)*(texture_array.ndim - 2)
+    return native_order(np.pad(native_order(texture_array), pad_widths, mode = 'edge'))
+
+def set_ram_image(texture, texture_array):
+    """
+    Copy uint8 texture_array into panda3d Texture texture (already set up with 
+    the same size and channels), in place of setRamImageAs(). 
+    
+    Arrays laid out as panda3d's ram image (see as_native) are copied straight
+    in. Others (e.g., rgb arrays with rgb memory, or slices) are converted while
+    copying, which is much slower for large textures: set CHECK_UPLOADS to True
+    to log each time this happens.
+    """
+    if CHECK_UPLOADS and not native_order(texture_array).flags.c_contiguous:
+        logger.warning("Texture %s: converting %s array with strides %s on upload", 
+                       texture.getName(), texture_array.shape, texture_array.strides)
+    np.copyto(native_order(ram_image_array(texture)), native_order(texture_array))
+    return texture
+    
+    
+def copy_texture(texture):
+    """
+    New panda3d Texture with the format, sampler settings and pixels of texture,
+    but its own ram image: Texture.makeCopy() shares the ram image, so writing 
+    into one copy would change the other (e.g., the texture being drawn).
+    """
+    copy = Texture(texture.getName())
+    if texture.getTextureType() == Texture.TT_3d_texture:
+        copy.setup3dTexture(texture.getXSize(), texture.getYSize(), texture.getZSize(),
+                            texture.getComponentType(), texture.getFormat())
+    else:
+        copy.setup2dTexture(texture.getXSize(), texture.getYSize(), 
+                            texture.getComponentType(), texture.getFormat())
+    copy.setDefaultSampler(texture.getDefaultSampler())
+    source = np.frombuffer(memoryview(texture.getRamImage()), dtype = np.uint8)
+    np.copyto(np.frombuffer(memoryview(copy.modifyRamImage()), dtype = np.uint8), source)
+    return copy
+    
+    
+class TextureCache:
+    """
+    Persistent on-disk cache of texture arrays (see textures.TextureBase).
+    
+    Arrays are saved as .npy files in cache_dir, named by a hash of the texture 
+    class, its version, texture_size, and params, plus the version of the cache.
+    Changing the cache version (e.g., to your git tag) invalidates everything 
+    stored with earlier versions. When the total size of the cache exceeds 
+    max_bytes, the least-recently-used arrays are deleted.
+    
+    Usage:
+        cache = TextureCache(max_bytes = 1e9)
+        sin_tex = textures.SinGrayTex(texture_size = 2048, cache = cache)
+    """
+    FORMAT_VERSION = 2  # 2: rgb arrays are saved in panda3d's bgr order (see native_order)
+    
+    def __init__(self, cache_dir = None, max_bytes = 2*1024**3, version = "1"):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".pandastim", "texture_cache")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = str(version)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok = True)
+        
+    def make_key(self, tex):
+        """
+        Content address for texture object tex: hash of class, version, size and 
+        the params that determine its array (content_params).
+        """
+        key_data = tex.content_id + (self.version, self.FORMAT_VERSION)
+        return hashlib.sha1(repr(key_data).encode()).hexdigest()
+    
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+    
+    def get(self, key):
+        """
+        Return cached array for key, or None if it is not in the cache.
+        """
+        file_path = self.path(key)
+        try:
+            array = np.load(file_path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError):
+            # Partially written or corrupted file: treat as a miss
+            self.misses += 1
+            self.remove(key)
+            return None
+        os.utime(file_path)  # mark as recently used for eviction
+        self.hits += 1
+        return native_order(array)
+    
+    def put(self, key, array):
+        """
+        Store array under key, then evict old entries if over max_bytes.
+        """
+        file_path = self.path(key)
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(native_order(array)))
+        os.replace(temp_path, file_path)  # atomic, so readers never see partial files
+        self.evict()
+        
+    def remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+        
+    def evict(self):
+        """
+        Delete least-recently-used arrays until cache is no larger than max_bytes.
+        """
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".npy"):
+                try:
+                    file_stat = os.stat(os.path.join(self.cache_dir, filename))
+                except FileNotFoundError:
+                    continue  # removed by another thread or process meanwhile
+                entries.append((file_stat.st_mtime, file_stat.st_size, filename))
+        total_bytes = sum(entry[1] for entry in entries)
+        for mtime, size, filename in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self.remove(filename[:-len(".npy")])
+            total_bytes -= size
+        return total_bytes
+    
+    def clear(self):
+        """
+        Delete everything in the cache.
+        """
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".npy"):
+                os.remove(os.path.join(self.cache_dir, filename))
+
+    def __str__(self):
+        return f"{type(self).__name__} dir:{self.cache_dir} hits:{self.hits} misses:{self.misses}"
+
+
+class CoordinateGrids:
+    """
+    Cache of read-only coordinate grids for texture generators, keyed by texture 
+    size and domain, so textures of the same size share one set of coordinates
+    instead of each making its own with np.linspace and np.meshgrid.
+    
+    Domains:
+        'cartesian': x and y in [0, 2*pi) across the texture (one cycle)
+        'pixel': x and y in pixels from the center of the texture, at pixel centers
+        'polar': radius (pixels) and angle (radians in [-pi, pi], counterclockwise 
+                 from the x axis) of pixel centers, from the center of the texture
+    
+    get() returns the pair of grids. Cartesian and pixel grids are broadcasting 
+    views (x is 1 x size and y is size x 1), so expressions like x + y make 
+    size x size results without a meshgrid; polar grids are full size x size 
+    float32 arrays (1/8 GB for the pair at 4096), so generators that only need 
+    part of them at a time should use pixel grids instead (see textures.IndexMapTex).
+    Least-recently-used grids are dropped when the total size of the cache 
+    exceeds max_bytes, and grids larger than max_bytes are returned without 
+    being kept.
+    
+    Usage:
+        x, y = utils.grids.get(512, 'cartesian')
+        radius, angle = utils.grids.get(512, 'polar')
+    """
+    DOMAINS = ('cartesian', 'pixel', 'polar')
     
+    def __init__(self, max_bytes = 256*1024**2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (domain, size): (grid1, grid2), least recent first
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, size, domain = 'cartesian'):
+        key = (domain, size)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        grids = self.make_grids(size, domain)
+        for grid in grids:
+            grid.flags.writeable = False
+        if self.grid_bytes(grids) > self.max_bytes:
+            return grids  # too large to keep
+        self.entries[key] = grids
+        while self.total_bytes() > self.max_bytes:
+            self.entries.popitem(last = False)
+        return grids
+    
+    def make_grids(self, size, domain):
+        if domain == 'cartesian':
+            x = np.linspace(0, 2*np.pi, size + 1)[: size]
+            return x[None, :], x[:, None]
+        if domain == 'pixel':
+            coords = np.arange(size) - (size - 1)/2
+            return coords[None, :], coords[:, None]
+        if domain == 'polar':
+            x, y = (coords.astype(np.float32) for coords in self.get(size, 'pixel'))
+            return np.hypot(x, y), np.arctan2(y, x)
+        raise ValueError(f"Coordinate grid domain must be one of {self.DOMAINS}, not {domain}")
+    
+    @staticmethod
+    def grid_bytes(grids):
+        return sum(grid.nbytes for grid in grids)  # counts views of shared coordinates twice
+    
+    def total_bytes(self):
+        return sum(self.grid_bytes(grids) for grids in self.entries.values())
+    
+    def clear(self):
+        self.entries.clear()
+        
+    def __str__(self):
+        return f"{type(self).__name__} grids:{len(self.entries)} hits:{self.hits} misses:{self.misses}"
+
+
+grids = CoordinateGrids()
+
+
+class TextureResidency:
+    """
+    Keeps the textures resident on the graphics card within a memory budget.
+
+    Each texture shown is prepared on the gsg (uploaded at the next frame), and
+    the least-recently-shown textures are released from video memory until the
+    total is no larger than budget_bytes. The texture on screen (the last one 
+    passed to show()) is never released, so a prefetch can't force it to be 
+    uploaded again while it is drawn. Released textures keep their ram image
+    (textures with keep_ram False get it made again, see textures.TextureBase),
+    so they can be prepared again later: call prefetch() ahead of a scheduled
+    switch so the upload happens before the texture is needed. Showing a texture
+    that is already resident is a hit, otherwise it is a miss.
+
+    Usage:
+        residency = TextureResidency(base.win.getGsg(), budget_bytes = 256*1024**2)
+        residency.show(sin_tex)       # when sin_tex is put on screen
+        residency.prefetch(next_tex)  # a frame or more before switching to next_tex
+
+    Note:
+        Sizes are estimated from the ram image (plus a third for mipmaps), so
+        budget_bytes should leave some headroom below the actual video memory.
+    """
+    def __init__(self, gsg, budget_bytes = 512*1024**2):
+        self.gsg = gsg
+        self.prepared_objects = gsg.getPreparedObjects()
+        self.budget_bytes = budget_bytes
+        self.resident = OrderedDict()  # id(texture): (texture, bytes), least recent first
+        self.shown_key = None  # id() of the texture on screen
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def texture_bytes(texture):
+        """
+        Estimated video memory used by panda3d Texture texture.
+        """
+        num_bytes = texture.getExpectedRamImageSize()
+        if texture.usesMipmaps():
+            num_bytes = num_bytes*4//3
+        return num_bytes
+
+    @property
+    def resident_bytes(self):
+        return sum(num_bytes for texture, num_bytes in self.resident.values())
+
+    def is_resident(self, tex):
+        return tex.texture.isPrepared(self.prepared_objects)
+
+    def show(self, tex):
+        """
+        Mark tex (textures.TextureBase) as shown: prepare it if needed, then
+        evict least-recently-shown textures if over budget.
+        """
+        if self.is_resident(tex):
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.shown_key = id(tex.texture)
+        self.prefetch(tex)
+
+    def prefetch(self, tex):
+        """
+        Prepare tex ahead of showing it, without counting a hit or miss.
+        """
+        texture = tex.texture
+        key = id(texture)
+        if key in self.resident:
+            self.resident.move_to_end(key)
+        else:
+            self.resident[key] = (texture, self.texture_bytes(texture))
+        if not texture.isPrepared(self.prepared_objects):
+            tex.restore_ram_image()
+            texture.prepare(self.prepared_objects)
+        self.evict(keep = key)
+
+    def evict(self, keep = None):
+        """
+        Release least-recently-shown textures (other than keep and the texture on
+        screen) until the resident textures are no larger than budget_bytes.
+        """
+        total_bytes = self.resident_bytes
+        for key in list(self.resident):
+            if total_bytes <= self.budget_bytes:
+                break
+            if key in (keep, self.shown_key):
+                continue
+            texture, num_bytes = self.resident.pop(key)
+            # releaseAll() rather than release(prepared_objects): pandastim uses
+            # one window, and the latter crashes in panda3d 1.10 when called from python
+            texture.releaseAll()
+            total_bytes -= num_bytes
+            self.evictions += 1
+        if total_bytes > self.budget_bytes:
+            logger.warning("TextureResidency: budget of %d bytes is too small for the textures on "
+                           "screen and being prefetched (%d bytes)", self.budget_bytes, total_bytes)
+        return total_bytes
+
+    def clear(self):
+        """
+        Release every texture tracked by the manager.
+        """
+        for texture, num_bytes in self.resident.values():
+            texture.releaseAll()
+        self.resident.clear()
+        self.shown_key = None
+
+    def __str__(self):
+        return (f"{type(self).__name__} resident:{len(self.resident)} ({self.resident_bytes} of "
+                f"{self.budget_bytes} bytes) hits:{self.hits} misses:{self.misses} evictions:{self.evictions}")
+
+
+class TextureBank:
+    """
+    Memory-mapped file of texture frames (e.g., a cube of phase-shifted gratings
+    for an animation), so frames are read from disk only when used, and several
+    processes showing the same bank share one copy in the OS page cache. 
+    
+    File format: a header of HEADER_SIZE bytes (magic string, format version,
+    number of frames, height, width, channels as little-endian uint32), followed
+    by the raw uint8 frames in C order. From format version 2, rgb frames are 
+    stored as bgr (panda3d's order, see native_order), so they are copied into
+    textures without conversion; frames are still indexed as rgb.
+    
+    Usage:
+        TextureBank.write('radial.bank', frames)  # once: frames is array or iterable of arrays
+        bank = TextureBank('radial.bank')
+        texture.setRamImage(bank[10])
+    """
+    MAGIC = b"PSTMBANK"
+    FORMAT_VERSION = 2
+    HEADER_SIZE = 4096  # keeps frames page-aligned
+    HEADER_STRUCT = struct.Struct("<8s5I")
+    
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, "rb") as f:
+            header = f.read(self.HEADER_STRUCT.size)
+        if len(header) < self.HEADER_STRUCT.size:
+            raise ValueError(f"{file_path} is not a texture bank (header too short)")
+        magic, version, num_frames, height, width, channels = self.HEADER_STRUCT.unpack(header)
+        if magic != self.MAGIC:
+            raise ValueError(f"{file_path} is not a texture bank")
+        if version not in (1, self.FORMAT_VERSION):
+            raise ValueError(f"{file_path} has texture bank version {version}, expected {self.FORMAT_VERSION}")
+        shape = (num_frames, height, width) + ((channels,) if channels > 1 else ())
+        self.frames = np.memmap(file_path, dtype = np.uint8, mode = "r", 
+                                offset = self.HEADER_SIZE, shape = shape)
+        if version > 1 and channels > 1:
+            self.frames = self.frames[..., ::-1]  # bgr on disk
+        
+    @classmethod
+    def write(cls, file_path, frames):
+        """
+        Write frames (n x h x w or n x h x w x 3 uint8 array, or an iterable of 
+        h x w (x 3) arrays, which need not all be in memory at once) to file_path.
+        """
+        num_frames = 0
+        frame_shape = None
+        with open(file_path, "wb") as f:
+            f.write(bytes(cls.HEADER_SIZE))
+            for frame in frames:
+                frame = np.ascontiguousarray(native_order(np.asarray(frame, dtype = np.uint8)))
+                if frame_shape is None:
+                    frame_shape = frame.shape
+                elif frame.shape != frame_shape:
+                    raise ValueError(f"All frames must have shape {frame_shape}, got {frame.shape}")
+                f.write(frame.data)
+                num_frames += 1
+            if frame_shape is None:
+                raise ValueError("Texture bank needs at least one frame")
+            channels = frame_shape[2] if len(frame_shape) == 3 else 1
+            f.seek(0)
+            f.write(cls.HEADER_STRUCT.pack(cls.MAGIC, cls.FORMAT_VERSION, num_frames, 
+                                           frame_shape[0], frame_shape[1], channels))
+        return cls(file_path)
+    
+    @property
+    def shape(self):
+        return self.frames.shape
+    
+    @property
+    def file_state(self):
+        """
+        Path, modification time and size of the file, for cache keys of textures 
+        made from the bank: a rewritten bank gets new keys (hashing the file would 
+        take as long as reading it).
+        """
+        bank_stat = os.stat(self.file_path)
+        return {'bank': os.path.abspath(self.file_path), 'modified': bank_stat.st_mtime_ns, 
+                'bytes': bank_stat.st_size}
+    
+    def __len__(self):
+        return self.frames.shape[0]
+    
+    def __getitem__(self, index):
+        return self.frames[index]
+    
+    def __str__(self):
+        return f"{type(self).__name__} {self.file_path} shape:{self.shape}"
+    
+    
+class FrameProducer:
+    """
+    Runs a frame generator in a separate process, for stimuli whose frames are 
+    computed as they are shown (e.g., reaction-diffusion patterns, stochastic 
+    fields), so computing them takes no time from rendering. The worker writes 
+    each frame into a ring buffer of num_slots frames in shared memory, and the 
+    stimulus (e.g., stimuli.ProducerStim) calls consume_newest() every frame to 
+    get the newest complete one: frames cross between the processes as raw 
+    memory, with no pickling.
+    
+    frame_function(*args, **kwargs) must return an iterator of uint8 arrays of 
+    frame_shape ((height, width), or (height, width, 3) for rgb), and be defined
+    at module level (it is sent to the worker once, when it starts). The worker
+    makes at most frame_rate frames per second if given, otherwise it runs as 
+    fast as it can, and frames the stimulus has no time to show are dropped.
+    
+    Counts: produced (frames the worker finished), consumed (frames passed to
+    consume_newest's function) and dropped (frames skipped or overwritten before
+    they could be consumed).
+    
+    Usage:
+        producer = FrameProducer(noise_frames, (512, 512), kwargs = {'seed': 1})
+        producer.start()
+        producer.consume_newest(lambda frame: set_ram_image(texture, frame))  # each frame
+        producer.stop()
+        
+    Note(s):
+        Each slot has a sequence number, odd while the worker is writing it (a 
+        seqlock), so a frame overwritten while it is being consumed is detected:
+        the newest frame is then consumed again, and the torn one counted as dropped.
+        Slots of rgb frames are stored as bgr, so they upload without conversion.
+    """
+    PRODUCED, STATE, SEQUENCES = 0, 1, 2  # header fields (int64): sequences are per slot
+    RUNNING, STOPPING, FINISHED, FAILED = range(4)  # worker states
+    
+    def __init__(self, frame_function, frame_shape, args = (), kwargs = None, 
+                 num_slots = 4, frame_rate = None):
+        if num_slots < 2:
+            raise ValueError(f"FrameProducer needs at least 2 slots, not {num_slots}")
+        self.frame_function = frame_function
+        self.frame_shape = tuple(frame_shape)
+        self.args = args
+        self.kwargs = {} if kwargs is None else kwargs
+        self.num_slots = num_slots
+        self.frame_rate = frame_rate
+        self.process = None
+        self.shared_block = None
+        self.header = None
+        self.slots = None
+        self.produced_count = 0  # produced, as of the last look at the header
+        self.consumed = 0
+        self.last_frame = -1  # number of the last frame consumed
+        
+    @classmethod
+    def header_bytes(cls, num_slots):
+        return 64*(-(-8*(cls.SEQUENCES + num_slots)//64))  # whole cache lines
+    
+    @classmethod
+    def shared_arrays(cls, shared_block, frame_shape, num_slots):
+        """
+        Header (int64) and slots (num_slots x frame_shape uint8, rgb views of bgr
+        memory) arrays in shared_block.
+        """
+        header = np.ndarray((cls.SEQUENCES + num_slots,), dtype = np.int64, buffer = shared_block.buf)
+        slots = np.ndarray((num_slots,) + tuple(frame_shape), dtype = np.uint8, 
+                           buffer = shared_block.buf, offset = cls.header_bytes(num_slots))
+        if len(frame_shape) == 3:
+            slots = slots[..., ::-1]  # rgb frames in bgr memory, like native_order()
+        return header, slots
+    
+    def start(self):
+        """
+        Create the ring buffer and start the worker process.
+        """
+        if os.name == 'posix':
+            # The worker must share our resource tracker, or it will complain about
+            # (and try to free) the block when it exits.
+            resource_tracker.ensure_running()
+        block_size = self.header_bytes(self.num_slots) + self.num_slots*int(np.prod(self.frame_shape))
+        self.shared_block = shared_memory.SharedMemory(create = True, size = block_size)
+        self.header, self.slots = self.shared_arrays(self.shared_block, self.frame_shape, self.num_slots)
+        self.header[...] = 0
+        self.process = multiprocessing.Process(target = produce_frames, daemon = True,
+                                               args = (self.shared_block.name, self.frame_shape, self.num_slots, 
+                                                       self.frame_rate, self.frame_function, self.args, self.kwargs))
+        self.process.start()
+        return self
+    
+    def stop(self, timeout = 1):
+        """
+        Stop the worker (terminating it if it doesn't stop within timeout seconds)
+        and free the ring buffer. Counts are kept.
+        """
+        if self.process is None:
+            return
+        self.produced_count = self.produced  # kept after the header is gone
+        if self.header[self.STATE] == self.RUNNING:
+            self.header[self.STATE] = self.STOPPING
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.header = self.slots = None  # views must go before the block is closed
+        self.shared_block.close()
+        self.shared_block.unlink()
+        self.process = self.shared_block = None
+        
+    def consume_newest(self, function):
+        """
+        Call function(frame) with the newest complete frame, if there is one newer
+        than the last frame consumed. frame is a view into the ring buffer, valid 
+        only during the call, so function should copy it (e.g., set_ram_image). 
+        Returns the number of the frame consumed, or None.
+        """
+        for attempt in range(self.num_slots):
+            frame_num = int(self.header[self.PRODUCED]) - 1
+            if frame_num <= self.last_frame:
+                return None
+            slot = frame_num % self.num_slots
+            sequence = 2*frame_num + 2  # once the frame is complete
+            if self.header[self.SEQUENCES + slot] != sequence:
+                continue  # already being overwritten
+            function(self.slots[slot])
+            if self.header[self.SEQUENCES + slot] == sequence:
+                self.consumed += 1
+                self.last_frame = frame_num
+                return frame_num
+        return None
+    
+    @property
+    def produced(self):
+        if self.header is not None:
+            self.produced_count = int(self.header[self.PRODUCED])
+        return self.produced_count
+    
+    @property
+    def dropped(self):
+        return self.last_frame + 1 - self.consumed
+    
+    @property
+    def finished(self):
+        """
+        Whether the started worker has stopped making frames (its iterator ended, or it failed).
+        """
+        return self.header is not None and self.header[self.STATE] in (self.FINISHED, self.FAILED)
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+        
+    def __str__(self):
+        return (f"{type(self).__name__} {getattr(self.frame_function, '__name__', self.frame_function)} "
+                f"produced:{self.produced} consumed:{self.consumed} dropped:{self.dropped}")
+    
+    
+def produce_frames(block_name, frame_shape, num_slots, frame_rate, frame_function, args, kwargs):
+    """
+    Worker process for FrameProducer: write the frames of frame_function(*args, **kwargs)
+    into the ring buffer in shared memory block block_name, until told to stop.
+    """
+    shared_block = shared_memory.SharedMemory(name = block_name)
+    header, slots = FrameProducer.shared_arrays(shared_block, frame_shape, num_slots)
+    next_time = time.perf_counter()
+    try:
+        for frame_num, frame in enumerate(frame_function(*args, **kwargs)):
+            if header[FrameProducer.STATE] != FrameProducer.RUNNING:
+                break
+            slot = frame_num % num_slots
+            header[FrameProducer.SEQUENCES + slot] = 2*frame_num + 1  # being written
+            slots[slot] = frame
+            header[FrameProducer.SEQUENCES + slot] = 2*frame_num + 2
+            header[FrameProducer.PRODUCED] = frame_num + 1
+            if frame_rate:
+                next_time += 1/frame_rate
+                time.sleep(max(next_time - time.perf_counter(), 0))
+        else:
+            header[FrameProducer.STATE] = FrameProducer.FINISHED
+    except Exception:
+        header[FrameProducer.STATE] = FrameProducer.FAILED
+        raise
+    finally:
+        del header, slots
+        shared_block.close()
+        
+        
 class Publisher:
     """
     Publisher wrapper class for zmq.
@@ -1,6 +1,5 @@
 #On filtering: https://www.panda3d.org/manual/?title=Texture_Filter_Types
 import numpy as np 
-import cv2
 import matplotlib.pyplot as plt
 from direct.showbase.ShowBase import ShowBase
 from panda3d.core import Texture, CardMaker, TextureStage, SamplerState, ClockObject
@@ -8,18 +7,23 @@ from direct.task import Task
 from panda3d.core import TransformState
 from direct.showbase import ShowBaseGlobal  #global vars defined by p3d
 
+import shapes
+
 
 #%%
 def concentric_circles(tex_size = 512, circ_center = (512//2, 512//2), 
                        bg_color = 0, circ_color = 255, circ_thickness = 25,
                        period = 50, phase_shift = 0):
     concentric_grating = bg_color*np.ones((tex_size, tex_size), dtype = np.uint8)
-    circ_radii = np.arange(tex_size+phase_shift, 0, -period)
-    #print(circ_radii)
-    num_circles = len(circ_radii)
-    for circ_ind in range(num_circles):
-        cv2.circle(concentric_grating, circ_center, circ_radii[circ_ind], 
-                   (circ_color, circ_color, circ_color), circ_thickness, lineType = cv2.LINE_AA);
+    # rings circ_thickness wide centered on radii tex_size + phase_shift - k*period > 0, 
+    # as cv2.circle drew them (now antialiased)
+    center = (circ_center[0] - tex_size/2, circ_center[1] - tex_size/2)
+    first_radius = (tex_size + phase_shift) % period
+    shapes.concentric_rings(concentric_grating, center, period, circ_thickness, 
+                            phase = first_radius - circ_thickness/2, intensity = circ_color)
+    if first_radius == 0:
+        # no ring at radius 0
+        shapes.disc(concentric_grating, center, circ_thickness/2, intensity = bg_color)
     return concentric_grating
                
 tex_size   = 512
@@ -0,0 +1,36 @@
+"""
+Gray-Scott reaction-diffusion pattern, computed in a separate process while it
+is shown (utils.FrameProducer, stimuli.ProducerStim): each frame is the newest
+state of the simulation, so it can't be computed ahead of time.
+"""
+import numpy as np
+
+import utils
+import stimuli
+
+def gray_scott_frames(size = 256, feed = 0.037, kill = 0.06, steps_per_frame = 10, seed = 0):
+    """
+    Yields uint8 frames (the v concentration) of a Gray-Scott simulation on a
+    size x size torus, seeded with random squares of v.
+    """
+    rng = np.random.default_rng(seed)
+    u = np.ones((size, size), dtype = np.float32)
+    v = np.zeros((size, size), dtype = np.float32)
+    for x, y in rng.integers(0, size - 10, size = (20, 2)):
+        u[y: y + 10, x: x + 10] = 0.5
+        v[y: y + 10, x: x + 10] = 0.25
+    frame = np.empty((size, size), dtype = np.uint8)
+    while True:
+        for step in range(steps_per_frame):
+            laplace_u = np.roll(u, 1, 0) + np.roll(u, -1, 0) + np.roll(u, 1, 1) + np.roll(u, -1, 1) - 4*u
+            laplace_v = np.roll(v, 1, 0) + np.roll(v, -1, 0) + np.roll(v, 1, 1) + np.roll(v, -1, 1) - 4*v
+            reaction = u*v*v
+            u += 0.2*laplace_u - reaction + feed*(1 - u)
+            v += 0.1*laplace_v + reaction - (feed + kill)*v
+        np.multiply(np.clip(v, 0, 0.4), 255/0.4, out = frame, casting = 'unsafe')
+        yield frame
+
+if __name__ == '__main__':
+    producer = utils.FrameProducer(gray_scott_frames, (256, 256), kwargs = {'seed': 1}, frame_rate = 60)
+    gray_scott_stim = stimuli.ProducerStim(producer, fps = 60, window_size = 512, report_interval = 5)
+    gray_scott_stim.run()
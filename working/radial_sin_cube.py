@@ -1,73 +1,56 @@
 """
-cube of concentric sinusoids: one shown in matplotlib, then in panda3d statically, then
-in task manager in sequence when they turn dark.
+cube of concentric sinusoids: one shown in matplotlib, then played in panda3d as a 3d
+texture (stimuli.CubeStim).
 """
+import os
 import numpy as np
 import matplotlib.pyplot as plt
-from direct.showbase.ShowBase import ShowBase
-from panda3d.core import Texture, CardMaker, TextureStage, SamplerState
-from direct.task import Task
-from direct.showbase import ShowBaseGlobal  #global vars defined by p3d
+
+import utils
+import textures
+import stimuli
 
 def radial_sin(texture_size = 512, phase = 0, period = 8):
-    x = np.linspace(-8*np.pi, 8*np.pi, texture_size)
-    y = np.linspace(-8*np.pi, 8*np.pi, texture_size)
-    return np.round((2*np.pi/period)*np.sin(np.sqrt(x[None, :]**2 +  y[:, None]**2)+phase)*127+127).astype(np.uint8)
+    """
+    Radial sinusoid(s): if phase is an array of N phases, returns N x texture_size x texture_size
+    cube computed in one broadcast pass (float32, in place) instead of looping over phases.
+    """
+    x = np.linspace(-8*np.pi, 8*np.pi, texture_size, dtype = np.float32)
+    y = np.linspace(-8*np.pi, 8*np.pi, texture_size, dtype = np.float32)
+    radius = np.sqrt(x[None, :]**2 +  y[:, None]**2)
+    phase = np.asarray(phase, dtype = np.float32)
+    cube = radius + phase[..., None, None]
+    np.sin(cube, out = cube)
+    cube *= (2*np.pi/period)*127
+    cube += 127
+    np.round(cube, out = cube)
+    return cube.astype(np.uint8)
+
+def radial_sin_chunks(phases, chunk_size = 16, **kwargs):
+    """
+    Frames of radial_sin() for each of phases, computed chunk_size phases at a time
+    (one broadcast pass per chunk), so the float32 cube is never all in memory.
+    """
+    for start in range(0, len(phases), chunk_size):
+        yield from radial_sin(phase = phases[start: start + chunk_size], **kwargs)
 
 num_slices = 190 #190 makes it periodic
-radial_cube = np.zeros(shape = (num_slices, 512, 512), dtype = np.uint8)
-phase = 0
 phase_change = 0.1
-for slice_num in range(num_slices):
-    rad_slice_i = radial_sin(period = 8, phase = phase)
-    phase += phase_change
-    radial_cube[slice_num,:,:] = rad_slice_i
+# Compute the cube once and save as a texture bank, a chunk of frames at a time: after that it is 
+# memory-mapped, so startup doesn't depend on cube length (frames are read from disk when shown)
+bank_path = "radial_sin_cube.bank"
+if not os.path.exists(bank_path):
+    utils.TextureBank.write(bank_path, radial_sin_chunks(phase_change*np.arange(num_slices), period = 8))
 
 #%% plot a random slice from the cube: it looks pretty bright and awesome
 #cube_ind = 10
-#rad_sin_i = radial_cube[cube_ind, :, :]
+#rad_sin_i = utils.TextureBank(bank_path)[cube_ind]
 #plt.imshow(rad_sin_i, cmap = 'Greys')
 #plt.title(f"Matplotlib slice {cube_ind}")
 #plt.show()
 # 
-#%%
-class TexCube(ShowBase):
-    def __init__(self, texture_cube, window_size = 512, texture_size = 512):
-        super().__init__()
-        self.num_slices = texture_cube.shape[0]
-        self.texture_cube = texture_cube
-        self.cube_ind = 0
-        #Create texture stage
-        self.texture = Texture("Stimulus")
-        
-        self.texture.setMagfilter(SamplerState.FT_linear)
-        #self.texture.setMinfilter(SamplerState.FT_nearest)
-        self.texture.setMinfilter(SamplerState.FT_linear_mipmap_linear)
-        
-        self.texture.setup2dTexture(texture_size, texture_size,
-                               Texture.T_unsigned_byte, Texture.F_luminance) 
-        self.texture.setRamImageAs(self.texture_cube[0, :, :], "L")       
-        self.textureStage = TextureStage("Stimulus")
-        #Create scenegraph
-        cm = CardMaker('card1')
-        cm.setFrameFullscreenQuad()
-        self.card1 = self.aspect2d.attachNewNode(cm.generate()) 
-        self.card1.setTexture(self.textureStage, self.texture)  #ts, tx
-        ShowBaseGlobal.base.setFrameRateMeter(True)
-        self.taskMgr.add(self.setTextureTask, "setTextureTask")
-       
-    #Scale the texture
-    def setTextureTask(self, task):
-        if  task.time > 0.5:
-            #self.texture.clearSimpleRamImage()
-            self.texture.setRamImageAs(self.texture_cube[self.cube_ind, :, :], "L")
-            #self.textureStage = TextureStage("Stimulus")
-            self.card1.setTexture(self.textureStage, self.texture)
-            self.cube_ind += 1
-            if self.cube_ind == self.num_slices:
-                self.cube_ind = 0
-        return Task.cont      
-          
+#%% Whole cube is loaded onto the graphics card once as a 3d texture: each frame only 
+# moves the w texture coordinate, so nothing is uploaded while it plays
 if __name__ == '__main__':
-    wave_cube = TexCube(radial_cube)
-    wave_cube.run()
\ No newline at end of file
+    wave_cube = stimuli.CubeStim(textures.CubeTex(utils.TextureBank(bank_path)), frame_rate = 60, fps = 60)
+    wave_cube.run()
@@ -4,6 +4,8 @@ from panda3d.core import Texture, CardMaker, TextureStage
 from direct.task import Task
 from panda3d.core import TransformState
 
+import textures
+
 def make_circle_tex(texture_size = 512, circle_center = (0, 0), circle_radius = 100):
     x = np.linspace(-texture_size/2, texture_size/2, texture_size)
     y = np.linspace(-texture_size/2, texture_size/2, texture_size)
@@ -25,52 +27,54 @@ def make_circle_tex(texture_size = 512, circle_center = (0, 0), circle_radius =
 
 class TexRand(ShowBase):
     """
-    Show a single full-field texture that scales up or down in time, starting after 1 second.
+    Show a circle that jumps to a random position every frame, starting after 1 second.
+    Frames are written in place into the texture's back buffer (see
+    textures.TextureBase.back_array()), so nothing is allocated per frame.
     """
-    def __init__(self, texture_array, window_size = 512, texture_size = 512):
+    def __init__(self, tex, window_size = 512):
         super().__init__() 
-        self.current_scale = 1
-        self.texture_array = texture_array
-        self.texture_dtype = type(self.texture_array.flat[0])
-        self.ndims = self.texture_array.ndim
-        self.center_shift = TransformState.make_pos2d((-0.5, -0.5))
-        self.shift_back = TransformState.make_pos2d((0.5, 0.5))
+        self.tex = tex
+        texture_size = self.tex.texture_size
+        x = np.linspace(-texture_size/2, texture_size/2, texture_size, dtype = np.float32)
+        self.x = x[None, :]
+        self.y = x[:, None]
+        # Work arrays for the circle, so each frame is computed without allocating
+        self.x_squared = np.empty((1, texture_size), dtype = np.float32)
+        self.y_squared = np.empty((texture_size, 1), dtype = np.float32)
+        self.distance_squared = np.empty((texture_size, texture_size), dtype = np.float32)
+        self.circle_mask = np.empty((texture_size, texture_size), dtype = bool)
+        self.pos = np.zeros(2, dtype = np.int16)
        
         #Create texture stage
-        self.texture = Texture("Stimulus")
-        self.texture.setup2dTexture(texture_size, texture_size, 
-                               Texture.T_unsigned_byte, Texture.F_luminance)  
-        self.texture.setWrapU(Texture.WM_clamp)
-        self.texture.setWrapV(Texture.WM_clamp)
-        self.texture.setRamImageAs(self.texture_array, "L")        
+        self.tex.texture.setWrapU(Texture.WM_clamp)
+        self.tex.texture.setWrapV(Texture.WM_clamp)
         self.textureStage = TextureStage("Stimulus")
                                                                     
         #Create scenegraph
         cm = CardMaker('card1')
         cm.setFrameFullscreenQuad()
         self.card1 = self.aspect2d.attachNewNode(cm.generate())  
-        self.card1.setTexture(self.textureStage, self.texture)  #ts, tx
+        self.card1.setTexture(self.textureStage, self.tex.texture)  #ts, tx
               
-
         self.taskMgr.add(self.setTextureTask, "setTextureTask")
         
-    #Scale the texture
+    def draw_circle(self, out, circle_center, circle_radius = 100):
+        np.subtract(self.x, circle_center[0], out = self.x_squared)
+        np.square(self.x_squared, out = self.x_squared)
+        np.subtract(self.y, circle_center[1], out = self.y_squared)
+        np.square(self.y_squared, out = self.y_squared)
+        np.add(self.x_squared, self.y_squared, out = self.distance_squared)
+        np.less_equal(self.distance_squared, circle_radius**2, out = self.circle_mask)
+        np.multiply(self.circle_mask, 255, out = out, casting = 'unsafe')
+        
     def setTextureTask(self, task):
         if task.time > 1:
-            self.pos = np.random.randint(-200, 200, size = 2, dtype = np.int16)
-            #self.texture.clearRamImage()
-            new_texture = make_circle_tex(texture_size = 512, circle_center = (self.pos[0], self.pos[1]))
-            self.texture_array = new_texture
-            self.texture.setRamImageAs(self.texture_array, "L")
-            #self.textureStage = TextureStage("Stimulus")
-            self.card1.setTexture(self.textureStage, self.texture)
-            
+            self.pos[:] = np.random.randint(-200, 200, size = 2)
+            self.draw_circle(self.tex.back_array(), self.pos)
+            self.card1.setTexture(self.textureStage, self.tex.swap_buffers())
         return Task.cont       
            
 if __name__ == '__main__':
-    circle_texture = make_circle_tex()
-    circle_rand = TexRand(circle_texture)
+    circle_tex = textures.CircleGrayTex(texture_size = 512, circle_radius = 100)
+    circle_rand = TexRand(circle_tex)
     circle_rand.run()
-
-
-